@@ -0,0 +1,24 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/backoff.py
+# Description: تاخیر نمایی با jitter برای تلاش دوباره اتصال به متاتریدر و کافکا.
+# ==================================================================
+import random
+
+
+class Backoff:
+    """Exponential backoff: initial, initial*factor, ... capped at `maximum`, each spread by +-`jitter`."""
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.initial * self.factor ** self.attempts, self.maximum)
+        self.attempts += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        self.attempts = 0
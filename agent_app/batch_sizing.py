@@ -0,0 +1,84 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/batch_sizing.py
+# Description: تعیین پویای تعداد ردیف هر batch بر اساس حجم واقعی پیام کدشده و تاخیر ack کافکا.
+# ==================================================================
+
+# حجم هدف هر پیام کافکا و سقف مطلق آن (کمی کمتر از max_request_size پیش‌فرض aiokafka یعنی 1MB)
+DEFAULT_TARGET_BYTES = 256 * 1024
+DEFAULT_MAX_MESSAGE_BYTES = 900 * 1024
+# اگر ack یک batch بیشتر از این طول بکشد، بودجه حجم موقتاً کوچک می‌شود
+DEFAULT_ACK_LATENCY_TARGET = 2.0
+
+
+class AdaptiveBatcher:
+    """
+    Chooses how many rows go into the next batch so that the encoded message lands near
+    `target_bytes`. The bytes-per-row estimate is a moving average of the encoded sizes seen
+    so far; the budget shrinks while broker acks are slower than `ack_latency_target` and
+    recovers when they are fast again. Batches that still encode above `max_bytes` are split.
+
+    An instance is callable and returns the next row count, so it can be passed wherever
+    MT5Manager's batch generators take a `batch_size`.
+    """
+
+    def __init__(self, initial_rows, target_bytes=DEFAULT_TARGET_BYTES, max_bytes=DEFAULT_MAX_MESSAGE_BYTES,
+                 min_rows=1, max_rows=100000, ack_latency_target=DEFAULT_ACK_LATENCY_TARGET, smoothing=0.3):
+        self.target_bytes = target_bytes
+        self.max_bytes = max_bytes
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.ack_latency_target = ack_latency_target
+        self.smoothing = smoothing
+        self.initial_rows = initial_rows
+        self.budget = float(target_bytes)
+        self.bytes_per_row = None
+        self.splits = 0
+
+    def __call__(self):
+        return self.next_rows()
+
+    def next_rows(self):
+        if self.bytes_per_row is None:
+            return self.initial_rows
+        rows = int(self.budget / self.bytes_per_row)
+        return max(self.min_rows, min(self.max_rows, rows))
+
+    def observe_size(self, rows, encoded_bytes):
+        if rows <= 0:
+            return
+        sample = encoded_bytes / rows
+        if self.bytes_per_row is None:
+            self.bytes_per_row = sample
+        else:
+            self.bytes_per_row += self.smoothing * (sample - self.bytes_per_row)
+
+    def observe_ack(self, latency):
+        if latency > self.ack_latency_target:
+            self.budget = max(self.budget * 0.7, self.target_bytes / 8)
+        elif latency < self.ack_latency_target / 4 and self.budget < self.target_bytes:
+            self.budget = min(self.budget * 1.25, self.target_bytes)
+
+    def encode(self, encode, batch):
+        """
+        Encodes `batch` (a list or array of rows) with `encode(rows) -> bytes` and returns a list of
+        (rows, payload) pairs: one pair normally, several halves if the payload exceeded `max_bytes`.
+        """
+        payload = encode(batch)
+        self.observe_size(len(batch), len(payload))
+        if len(payload) <= self.max_bytes or len(batch) <= 1:
+            return [(batch, payload)]
+        self.splits += 1
+        middle = len(batch) // 2
+        return self.encode(encode, batch[:middle]) + self.encode(encode, batch[middle:])
+
+    def ack_tracker(self, on_delivery=None):
+        """
+        Returns an on_delivery callback for publish_batches that feeds the ack latencies measured
+        by the publisher back into the batcher, then calls `on_delivery` (if given).
+        """
+        def delivered(index, error, latency=None):
+            if error is None and latency is not None:
+                self.observe_ack(latency)
+            if on_delivery:
+                on_delivery(index, error, latency)
+        return delivered
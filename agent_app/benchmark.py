@@ -0,0 +1,342 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/benchmark.py
+# Description: بنچمارک سرتاسری ایجنت با MetaTrader5 و تولیدکننده کافکای جعلی (قابل اجرا روی لینوکس / CI).
+# ==================================================================
+"""
+Usage:
+    python benchmark.py --rows 100000 --symbols 5000 --latency-ms 20 --codecs json columnar
+
+Installs a stand-in `MetaTrader5` module (synthetic structured arrays of configurable size)
+and an in-memory AIOKafkaProducer with configurable ack latency, then drives
+MT5Manager.get_rates_in_batches / get_all_symbols_in_batches and AgentClient.sync_*_in_batches
+headlessly. Reports rows/sec, bytes/sec, peak RSS and per-stage timings.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+import types
+import numpy as np
+
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8'),
+])
+TICKS_DTYPE = np.dtype([
+    ('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+    ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8'),
+])
+SYMBOL_FIELDS = (
+    'name', 'description', 'path', 'currency_base', 'currency_profit', 'currency_margin', 'digits', 'spread',
+    'trade_mode', 'trade_contract_size', 'volume_min', 'volume_max', 'volume_step', 'swap_long', 'swap_short',
+    'point', 'bid', 'ask', 'last', 'time', 'session_deals', 'volume',
+)
+TIMEFRAMES = {'M1': 1, 'M5': 5, 'M15': 15, 'M30': 30, 'H1': 16385, 'H4': 16388, 'D1': 16408}
+
+
+# ==============================================================================
+# ماژول جعلی MetaTrader5
+# ==============================================================================
+def build_fake_mt5(rows=100000, symbols=5000, call_latency=0.0, now=1_700_000_000):
+    """Returns a module object mimicking the parts of MetaTrader5 the agent uses."""
+    mt5 = types.ModuleType("MetaTrader5")
+    for name, value in TIMEFRAMES.items():
+        setattr(mt5, f"TIMEFRAME_{name}", value)
+    mt5.COPY_TICKS_ALL = -1
+    now -= now % 60
+    rng = np.random.default_rng(42)
+    symbol_info = collections.namedtuple("SymbolInfo", SYMBOL_FIELDS)
+    account_info = collections.namedtuple("AccountInfo", "login balance equity margin currency")
+    tick_info = collections.namedtuple("Tick", "time bid ask last volume time_msc flags volume_real")
+
+    def call(result):
+        if call_latency:
+            time.sleep(call_latency)
+        return result
+
+    def make_rates(times):
+        bars = np.zeros(len(times), dtype=RATES_DTYPE)
+        bars['time'] = times
+        closes = 1.1 + np.cumsum(rng.normal(0, 1e-4, len(times)))
+        bars['open'] = closes - 5e-5
+        bars['close'] = closes
+        bars['high'] = closes + 2e-4
+        bars['low'] = closes - 2e-4
+        bars['tick_volume'] = rng.integers(1, 500, len(times))
+        bars['spread'] = rng.integers(0, 30, len(times))
+        return bars
+
+    def as_epoch(value):
+        return int(value.timestamp()) if hasattr(value, 'timestamp') else int(value)
+
+    mt5.initialize = lambda *args, **kwargs: True
+    mt5.shutdown = lambda: None
+    mt5.last_error = lambda: (1, "Success")
+    mt5.terminal_info = lambda: True
+    mt5.account_info = lambda: call(account_info(123456, 10000.0, 10000.0, 0.0, "USD"))
+    mt5.symbols_get = lambda *args: call([
+        symbol_info(f"SYM{i:05d}", f"Synthetic instrument number {i} " * (1 + i % 4), f"Forex\\Majors\\SYM{i:05d}",
+                    "EUR", "USD", "USD", 5, 10, 4, 100000.0, 0.01, 100.0, 0.01, -1.2, 0.4, 1e-5,
+                    1.1, 1.1001, 0.0, now, 0, 0)
+        for i in range(symbols)
+    ])
+    mt5.copy_rates_from_pos = lambda symbol, timeframe, start, count: call(
+        make_rates(np.arange(now - 60 * min(count, rows), now, 60)))
+    mt5.copy_rates_range = lambda symbol, timeframe, date_from, date_to: call(make_rates(np.arange(
+        max(-(-as_epoch(date_from) // 60) * 60, now - 60 * rows), min(as_epoch(date_to), now), 60)))
+
+    def copy_ticks(count, start_msc, step_msc=100):
+        ticks = np.zeros(count, dtype=TICKS_DTYPE)
+        ticks['time_msc'] = start_msc + np.arange(count) * step_msc
+        ticks['time'] = ticks['time_msc'] // 1000
+        ticks['bid'] = 1.1
+        ticks['ask'] = 1.1001
+        return ticks
+
+    mt5.copy_ticks_from = lambda symbol, date_from, count, flags: call(
+        copy_ticks(min(count, 10), as_epoch(date_from) * 1000 + 1))
+    mt5.copy_ticks_range = lambda symbol, date_from, date_to, flags: call(
+        copy_ticks(max(0, (as_epoch(date_to) - as_epoch(date_from)) * 10), as_epoch(date_from) * 1000))
+    mt5.symbol_info_tick = lambda symbol: tick_info(now, 1.1, 1.1001, 0.0, 0, int(time.time() * 1000), 0, 0.0)
+    mt5.positions_get = lambda *args, **kwargs: call(())
+    mt5.orders_get = lambda *args, **kwargs: call(())
+    return mt5
+
+
+# ==============================================================================
+# تولیدکننده جعلی کافکا
+# ==============================================================================
+class FakeKafkaProducer:
+    """In-memory stand-in for AIOKafkaProducer: acks every message after `latency` seconds."""
+    latency = 0.0
+
+    def __init__(self, **options):
+        self.options = options
+        self.messages = 0
+        self.bytes = 0
+        self.ack_latencies = []
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, topic, value, key=None, headers=None, partition=None):
+        loop = asyncio.get_running_loop()
+        delivery = loop.create_future()
+        sent_at = time.perf_counter()
+        self.messages += 1
+        self.bytes += len(value)
+
+        def ack():
+            self.ack_latencies.append(time.perf_counter() - sent_at)
+            if not delivery.done():
+                delivery.set_result(None)
+        loop.call_later(self.latency, ack)
+        return delivery
+
+    async def send_and_wait(self, topic, value, **kwargs):
+        return await (await self.send(topic, value, **kwargs))
+
+
+def install_fakes(args, state_dir):
+    """Puts the fakes into sys.modules and points all local state files into `state_dir`."""
+    sys.modules["MetaTrader5"] = build_fake_mt5(args.rows, args.symbols, args.mt5_latency_ms / 1000)
+    FakeKafkaProducer.latency = args.latency_ms / 1000
+    aiokafka = types.ModuleType("aiokafka")
+    aiokafka.AIOKafkaProducer = FakeKafkaProducer
+    sys.modules["aiokafka"] = aiokafka
+
+    import config
+    config.LOG_FILE = os.path.join(state_dir, "logs", "agent.log")
+    config.WATERMARK_FILE = os.path.join(state_dir, "data", "watermarks.json")
+    config.SPOOL_DIR = os.path.join(state_dir, "spool")
+    config.SYMBOL_HASH_FILE = os.path.join(state_dir, "data", "symbol_hashes.json")
+    config.HTTP_CACHE_FILE = os.path.join(state_dir, "data", "http_cache.json")
+    config.TICK_CHECKPOINT_FILE = os.path.join(state_dir, "data", "tick_checkpoints.json")
+    config.RATES_CACHE_DIR = os.path.join(state_dir, "data", "rates_cache")
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # ویندوز
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+# ==============================================================================
+# سناریوها
+# ==============================================================================
+def connect_client(args):
+    from mt5_manager import MT5Manager
+    from server import AgentClient
+    events = queue.Queue()
+    manager = MT5Manager()
+    client = AgentClient(events, manager)
+    client.set_server_address("fake-broker:9092", "http://127.0.0.1:9")
+    client.set_producer_options(max_in_flight=args.in_flight)
+    client.start()
+    deadline = time.monotonic() + 10
+    while client.publisher is None or client.login_number is None:
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake client did not become ready")
+        time.sleep(0.01)
+    return manager, client
+
+
+def bench_rates_stages(manager, codec_name, args):
+    """Times MT5 fetch + transform and encoding separately, without Kafka."""
+    from wire_format import get_codec
+    codec = get_codec(codec_name)
+    generator = manager.get_rates_in_batches("SYM00000", lambda current, total: None, total_count=args.rows,
+                                             raw=codec.wants_raw)
+    fetch_time = encode_time = 0.0
+    encoded_bytes = rows = 0
+    meta = {"type": "sync_rates_data", "login": 123456, "symbol": "SYM00000", "timeframe": 1}
+    while True:
+        started = time.perf_counter()
+        batch = next(generator, None)
+        fetch_time += time.perf_counter() - started
+        if batch is None:
+            break
+        started = time.perf_counter()
+        encoded_bytes += len(codec.encode_rates(meta, batch))
+        encode_time += time.perf_counter() - started
+        rows += len(batch)
+    return {"rows": rows, "fetch_transform_s": fetch_time, "encode_s": encode_time, "bytes": encoded_bytes}
+
+
+def bench_rates_cache(manager, args):
+    """Fetch time of the same raw rates request with an empty and with a warm rates cache."""
+    manager.enable_rates_cache()
+    timings = {}
+    for run_name in ("cold", "warm"):
+        started = time.perf_counter()
+        rows = sum(len(batch) for batch in manager.get_rates_in_batches(
+            "SYM00002", lambda current, total: None, total_count=args.rows, raw=True))
+        timings[f"{run_name}_s"] = time.perf_counter() - started
+    manager.rates_cache = None
+    return {"rows": rows, **timings}
+
+
+def bench_rates_end_to_end(manager, client, codec_name, args):
+    client.set_wire_format(codec_name)
+    client.watermarks.reset(client.login_number)
+    producer = client.producer
+    messages_before, bytes_before = producer.messages, producer.bytes
+    started = time.perf_counter()
+    batcher = client.new_batcher(5000)
+    generator = manager.get_rates_in_batches("SYM00001", lambda current, total: None, total_count=args.rows,
+                                             batch_size=batcher, raw=client.rates_codec.wants_raw)
+    report = client.sync_rates_data_in_batches("SYM00001", generator, batcher=batcher)
+    elapsed = time.perf_counter() - started
+    return {"rows": args.rows, "elapsed_s": elapsed, "messages": producer.messages - messages_before,
+            "bytes": producer.bytes - bytes_before, "failed": len(report.errors)}
+
+
+def bench_symbols(manager, client):
+    producer = client.producer
+    bytes_before = producer.bytes
+    rows = [0]
+
+    def counted(generator):
+        for batch in generator:
+            rows[0] += len(batch or ())
+            yield batch
+
+    started = time.perf_counter()
+    batcher = client.new_batcher(500)
+    report = client.sync_symbols_in_batches(
+        counted(manager.get_all_symbols_in_batches(lambda current, total: None, batcher)), batcher=batcher)
+    elapsed = time.perf_counter() - started
+    return {"rows": rows[0], "elapsed_s": elapsed, "bytes": producer.bytes - bytes_before,
+            "messages": report.sent, "failed": len(report.errors)}
+
+
+def format_rate(value, unit):
+    for prefix in ("", "K", "M", "G"):
+        if abs(value) < 1000:
+            return f"{value:8.1f} {prefix}{unit}"
+        value /= 1000
+    return f"{value:8.1f} T{unit}"
+
+
+def run(args):
+    results = {"settings": vars(args), "stages": {}, "end_to_end": {}}
+    manager, client = connect_client(args)
+    try:
+        for codec_name in args.codecs:
+            stages = bench_rates_stages(manager, codec_name, args)
+            results["stages"][codec_name] = stages
+            print(f"[stages/{codec_name:8s}] fetch+transform {stages['fetch_transform_s'] * 1000:8.1f} ms | "
+                  f"encode {stages['encode_s'] * 1000:8.1f} ms | payload {stages['bytes'] / 1e6:7.2f} MB "
+                  f"({stages['bytes'] / max(stages['rows'], 1):.1f} B/row)")
+
+        if args.rates_cache:
+            cached = bench_rates_cache(manager, args)
+            results["stages"]["rates_cache"] = cached
+            print(f"[rates cache    ] cold {cached['cold_s'] * 1000:8.1f} ms | warm {cached['warm_s'] * 1000:8.1f} ms | "
+                  f"{cached['rows']} rows")
+
+        for codec_name in args.codecs:
+            e2e = bench_rates_end_to_end(manager, client, codec_name, args)
+            results["end_to_end"][f"rates/{codec_name}"] = e2e
+            print(f"[rates/{codec_name:8s}] {format_rate(e2e['rows'] / e2e['elapsed_s'], 'rows/s')} | "
+                  f"{format_rate(e2e['bytes'] / e2e['elapsed_s'], 'B/s')} | {e2e['messages']} msgs | "
+                  f"{e2e['elapsed_s']:.3f}s | failed {e2e['failed']}")
+
+        symbols = bench_symbols(manager, client)
+        results["end_to_end"]["symbols"] = symbols
+        print(f"[symbols        ] {format_rate(symbols['rows'] / symbols['elapsed_s'], 'rows/s')} | "
+              f"{format_rate(symbols['bytes'] / symbols['elapsed_s'], 'B/s')} | {symbols['messages']} msgs | "
+              f"{symbols['elapsed_s']:.3f}s")
+
+        latencies = sorted(client.producer.ack_latencies)
+        if latencies:
+            results["ack_latency_ms"] = {
+                "p50": latencies[len(latencies) // 2] * 1000,
+                "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+            }
+    finally:
+        client.stop()
+        client.wait_closed()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    if results["peak_rss_mb"] is not None:
+        print(f"[memory         ] peak RSS {results['peak_rss_mb']:.1f} MB")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless throughput benchmark with fake MT5 and Kafka")
+    parser.add_argument("--rows", type=int, default=100000, help="M1 bars returned per rates request")
+    parser.add_argument("--symbols", type=int, default=5000, help="symbols returned by symbols_get")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="fake broker ack latency")
+    parser.add_argument("--mt5-latency-ms", type=float, default=0.0, help="fake terminal call latency")
+    parser.add_argument("--in-flight", type=int, default=64, help="per-topic in-flight window")
+    parser.add_argument("--codecs", nargs="+", default=["json", "columnar"])
+    parser.add_argument("--rates-cache", action="store_true", help="also time rates fetches through the local cache")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="agent-bench-") as state_dir:
+        install_fakes(args, state_dir)
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
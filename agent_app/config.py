@@ -1,4 +1,34 @@
 # C:\...\windows_agent_project\client\agent_app\config.py
 
 # مسیر فایل لاگ به صورت نسبی تعریف شده تا برنامه قابل حمل باشد
-LOG_FILE = r'..\logs\agent.log'
\ No newline at end of file
+LOG_FILE = r'..\logs\agent.log'
+
+# چرخش فایل لاگ: بر اساس حجم، یا اگر LOG_ROTATE_WHEN تنظیم شود (مثلاً "midnight") بر اساس زمان
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_ROTATE_WHEN = None
+
+# "text" یا "json" (هر رکورد یک خط JSON)
+LOG_FORMAT = "text"
+
+# پیام‌های تکراری در هر بازه حداکثر چند بار ثبت می‌شوند؛ صفر یعنی بدون محدودیت
+LOG_RATE_LIMIT_SECONDS = 10
+
+# فایل محلی high-water mark ها برای همگام‌سازی افزایشی کندل‌ها
+WATERMARK_FILE = r'..\data\watermarks.json'
+
+# پوشه صف ماندگار پیام‌هایی که به کافکا نرسیده‌اند
+SPOOL_DIR = r'..\spool'
+
+# hash محتوای نمادهای ارسال‌شده برای همگام‌سازی تفاضلی کاتالوگ
+SYMBOL_HASH_FILE = r'..\data\symbol_hashes.json'
+
+# کش محلی لیست نمادهای دیتابیس (برای پر شدن فوری لیست در شروع برنامه)
+HTTP_CACHE_FILE = r'..\data\http_cache.json'
+
+# نقطه ادامه خروجی تاریخچه تیک (میلی‌ثانیه) برای هر (login, symbol)
+TICK_CHECKPOINT_FILE = r'..\data\tick_checkpoints.json'
+
+# کش محلی کندل‌ها (فایل‌های memory-map شده برای هر نماد و تایم‌فریم) و سقف حجم آن
+RATES_CACHE_DIR = r'..\data\rates_cache'
+RATES_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
@@ -0,0 +1,164 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/connection_supervisor.py
+# Description: پایش مستقل اتصال متاتریدر و کافکا و اتصال دوباره خودکار بدون خاموش کردن ایجنت.
+# ==================================================================
+import asyncio
+import time
+from logger import setup_logger
+from backoff import Backoff
+
+DEFAULT_CHECK_INTERVAL = 5.0
+KAFKA_PROBE_TIMEOUT = 5.0
+KAFKA_REBUILD_AFTER = 3
+
+
+class ConnectionSupervisor:
+    """
+    Keeps the MT5 terminal link and the Kafka producer alive for an AgentClient, on its
+    background loop. Each link is checked every `check_interval` seconds and reconnected with
+    exponential backoff and jitter; an outage of one never tears down the other, the event loop
+    or the queued sync work. A producer that fails `rebuild_after` probes in a row is stopped and
+    a new one is started (one attempt per check, spaced by `kafka_backoff`). While Kafka is down, messages go to the on-disk spool. When a link
+    comes back the spool is replayed and syncs that failed during the outage are resubmitted
+    (their watermarks already cover everything that was delivered).
+    """
+
+    def __init__(self, client, check_interval=DEFAULT_CHECK_INTERVAL, rebuild_after=KAFKA_REBUILD_AFTER):
+        self.logger = setup_logger()
+        self.client = client
+        self.check_interval = check_interval
+        self.rebuild_after = rebuild_after
+        self.kafka_backoff = Backoff(initial=0.5, maximum=30.0)
+        self.kafka_up = False
+        self.mt5_up = False
+        self.outages = {"kafka": 0, "mt5": 0}
+        self._down_since = {}
+        self._last_check = 0.0
+        self._kafka_failures = 0
+        self._next_rebuild = 0.0
+
+    def _changed(self, link, up):
+        """Logs and reports a link state change; returns True when the link just recovered."""
+        if up:
+            downtime = time.monotonic() - self._down_since.pop(link, time.monotonic())
+            self.client.log_and_gui(f"{link} connection restored after {downtime:.1f}s.", "info")
+        else:
+            self.outages[link] += 1
+            self._down_since[link] = time.monotonic()
+            self.client.log_and_gui(f"{link} connection lost; reconnecting in the background.", "warning")
+        self.client.gui_callback_queue.put({"type": "connection_status", "link": link, "up": up})
+        return up
+
+    async def connect_kafka(self):
+        """Starts a producer, retrying with backoff until it connects or the client stops."""
+        client = self.client
+        while client.running:
+            try:
+                await self._start_producer()
+            except Exception as e:
+                delay = self.kafka_backoff.next_delay()
+                client.log_and_gui(f"Kafka unavailable ({e}); retrying in {delay:.1f}s.", "warning")
+                await self.pause(delay)
+                continue
+            self.kafka_up = True
+            return True
+        return False
+
+    async def _start_producer(self):
+        """One attempt to start and attach a new producer; the failed producer is stopped."""
+        client = self.client
+        producer = client.create_producer()
+        try:
+            await producer.start()
+        except Exception:
+            try:
+                await producer.stop()
+            except Exception:
+                pass
+            raise
+        client.attach_producer(producer)
+        self.kafka_backoff.reset()
+
+    async def _rebuild_kafka(self):
+        """Replaces a producer that keeps failing probes; returns True once a new one is attached."""
+        if time.monotonic() < self._next_rebuild:
+            return False
+        client = self.client
+        producer = client.producer
+        if producer is not None:
+            # تا ساخت تولیدکننده جدید، پیام‌ها به spool می‌روند
+            client.producer = None
+            client.publisher = None
+            try:
+                await producer.stop()
+            except Exception as e:
+                self.logger.warning(f"Stopping the failed Kafka producer raised: {e}")
+        try:
+            await self._start_producer()
+        except Exception as e:
+            delay = self.kafka_backoff.next_delay()
+            self._next_rebuild = time.monotonic() + delay
+            client.log_and_gui(f"Kafka producer rebuild failed ({e}); retrying in {delay:.1f}s.", "warning")
+            return False
+        self._kafka_failures = 0
+        return await self._probe_kafka()
+
+    async def _probe_kafka(self):
+        """Refreshes cluster metadata; False means no broker answered in time."""
+        cluster_client = getattr(self.client.producer, "client", None)
+        if cluster_client is None or not hasattr(cluster_client, "force_metadata_update"):
+            return self.client.producer is not None
+        try:
+            return bool(await asyncio.wait_for(cluster_client.force_metadata_update(), KAFKA_PROBE_TIMEOUT))
+        except Exception:
+            return False
+
+    async def connect_mt5(self):
+        """Checks the terminal link; MT5Manager.connect applies its own reconnect backoff."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self.client.mt5.connect)
+        except Exception as e:
+            self.logger.warning(f"MT5 connection check raised: {e}")
+            return False
+
+    async def wait_for_mt5(self):
+        """Waits (without blocking the loop) until the terminal is connected; False if the client stopped."""
+        while self.client.running:
+            if await self.connect_mt5():
+                self.mt5_up = True
+                return True
+            await self.pause(1.0)
+        return False
+
+    async def check(self):
+        """Periodic health check of both links; call it from the client's main loop."""
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        self._last_check = time.monotonic()
+        recovered = False
+
+        mt5_up = await self.connect_mt5()
+        if mt5_up != self.mt5_up:
+            self.mt5_up = mt5_up
+            recovered |= self._changed("mt5", mt5_up)
+
+        kafka_up = await self._probe_kafka()
+        self._kafka_failures = 0 if kafka_up else self._kafka_failures + 1
+        if self._kafka_failures >= self.rebuild_after:
+            kafka_up = await self._rebuild_kafka()
+        if kafka_up != self.kafka_up:
+            self.kafka_up = kafka_up
+            recovered |= self._changed("kafka", kafka_up)
+
+        if recovered and self.mt5_up and self.kafka_up:
+            await self.client._replay_spool()
+            resumed = self.client.sync_scheduler.resume_failed()
+            if resumed:
+                self.client.log_and_gui(f"Resumed {resumed} syncs interrupted by the outage.", "info")
+
+    async def pause(self, seconds):
+        """Sleeps up to `seconds`, returning early once the client stops."""
+        deadline = time.monotonic() + seconds
+        while self.client.running and time.monotonic() < deadline:
+            await asyncio.sleep(min(0.5, deadline - time.monotonic()))
@@ -5,9 +5,9 @@ import tkinter as tk
 from tkinter import ttk, font
 import sv_ttk
 import threading
-import queue
 import json
 import time
+from collections import deque
 from server import AgentClient
 from mt5_manager import MT5Manager
 
@@ -15,6 +15,60 @@ from mt5_manager import MT5Manager
 # ==============================================================================
 # بخش ۱: کامپوننت سفارشی SearchableCombobox
 # ==============================================================================
+class SymbolSearchIndex:
+    """
+    ایندکس جستجوی زیررشته‌ای case-insensitive برای لیست‌های بزرگ نماد.
+    کلیدهای lowercase و ایندکس سه‌حرفی (trigram) یک بار ساخته می‌شوند؛ وقتی عبارت جدید
+    شامل عبارت قبلی باشد، فقط نتایج قبلی دوباره فیلتر می‌شوند. نتایج با اولویت تطابق پیشوندی
+    و با سقف `limit` برگردانده می‌شوند.
+    """
+
+    def __init__(self, items=(), limit=200):
+        self.limit = limit
+        self.items = sorted(items)
+        self._keys = [item.lower() for item in self.items]
+        self._trigrams = {}
+        for index, key in enumerate(self._keys):
+            for gram in {key[i:i + 3] for i in range(len(key) - 2)}:
+                self._trigrams.setdefault(gram, []).append(index)
+        self._last_term = None
+        self._last_matches = None
+
+    def _candidates(self, term):
+        if self._last_term and self._last_term in term:
+            return self._last_matches
+        if len(term) < 3:
+            return range(len(self._keys))
+        postings = sorted((self._trigrams.get(term[i:i + 3], ()) for i in range(len(term) - 2)), key=len)
+        if not postings[0]:
+            return ()
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return sorted(candidates)
+
+    def search(self, term):
+        """نتایج مرتب‌شده (ابتدا تطابق‌های پیشوندی) را با حداکثر `limit` آیتم برمی‌گرداند."""
+        term = term.lower()
+        if not term:
+            self._last_term = self._last_matches = None
+            return self.items[:self.limit]
+
+        keys = self._keys
+        matches = [index for index in self._candidates(term) if term in keys[index]]
+        self._last_term, self._last_matches = term, matches
+
+        prefix, others = [], []
+        for index in matches:
+            (prefix if keys[index].startswith(term) else others).append(index)
+            if len(prefix) >= self.limit:
+                break
+        ranked = (prefix + others)[:self.limit]
+        return [self.items[index] for index in ranked]
+
+
 class SearchableCombobox(ttk.Combobox):
     """
     یک ویجت ttk.Combobox که قابلیت جستجوی زنده و case-insensitive را
@@ -24,6 +78,7 @@ class SearchableCombobox(ttk.Combobox):
     def __init__(self, master=None, on_select_callback=None, **kwargs):
         super().__init__(master, **kwargs)
         self._master_list = []
+        self._index = SymbolSearchIndex()
         self._string_var = self['textvariable']
         if not self._string_var:
             self._string_var = tk.StringVar()
@@ -35,10 +90,15 @@ class SearchableCombobox(ttk.Combobox):
 
     def set_master_list(self, data_list):
         """
-        لیست اصلی داده‌ها را برای جستجو تنظیم می‌کند.
+        لیست اصلی داده‌ها را برای جستجو تنظیم می‌کند و ایندکس جستجو را یک بار می‌سازد.
         """
-        self._master_list = sorted(data_list) if data_list else []
-        self['values'] = self._master_list
+        self._index = SymbolSearchIndex(data_list or [])
+        self._master_list = self._index.items
+        self['values'] = self._index.search("")
+
+    @property
+    def master_list(self):
+        return self._master_list
 
     def _on_text_change(self, *args):
         """
@@ -50,19 +110,10 @@ class SearchableCombobox(ttk.Combobox):
 
     def _perform_search(self):
         """
-        منطق اصلی فیلتر کردن و به‌روزرسانی لیست را اجرا می‌کند.
+        منطق اصلی فیلتر کردن و به‌روزرسانی لیست را اجرا می‌کند؛ فقط نتایج محدودشده به ویجت Tk داده می‌شوند.
         """
-        if not isinstance(self._master_list, (list, tuple)):
-            return
-        search_term = self._string_var.get().lower()
-        if not search_term:
-            filtered_list = self._master_list
-        else:
-            filtered_list = [
-                item for item in self._master_list
-                if search_term in item.lower()
-            ]
-        self['values'] = filtered_list
+        self._search_job = None
+        self['values'] = self._index.search(self._string_var.get())
 
     def _on_selection(self, event):
         """
@@ -78,25 +129,85 @@ class SearchableCombobox(ttk.Combobox):
 
 
 # ==============================================================================
-# بخش ۲: کلاس اصلی برنامه GUI
+# بخش ۲: صف رویدادهای GUI با ادغام پیشرفت و محدودیت پیام‌ها
+# ==============================================================================
+class GuiEventPipeline:
+    """
+    جایگزین queue.Queue برای رویدادهایی که thread های همگام‌سازی به GUI می‌فرستند.
+    پیام‌های progress_update برای هر نماد ادغام می‌شوند (آخرین مقدار برنده است)، پیام‌های لاگ
+    در یک بافر محدود جمع می‌شوند و مازاد آن‌ها فقط شمارش می‌شود؛ سایر رویدادها به ترتیب نگه داشته می‌شوند.
+    """
+
+    def __init__(self, max_logs=200):
+        self.lock = threading.Lock()
+        self._progress = {}
+        self._logs = deque(maxlen=max_logs)
+        self._dropped_logs = 0
+        self._events = deque()
+
+    def put(self, msg):
+        with self.lock:
+            if not isinstance(msg, dict):
+                msg = {"type": "log", "level": "info", "message": str(msg)}
+            msg_type = msg.get("type")
+            if msg_type == "progress_update":
+                key = msg.get("symbol")
+                merged = self._progress.pop(key, {})
+                merged.update(msg)
+                self._progress[key] = merged  # ترتیب درج = ترتیب آخرین به‌روزرسانی
+            elif msg_type == "log":
+                if len(self._logs) == self._logs.maxlen:
+                    self._dropped_logs += 1
+                self._logs.append(msg)
+            else:
+                if msg_type == "sync_finished":
+                    self._progress.pop(msg.get("symbol"), None)
+                self._events.append(msg)
+
+    def pending(self):
+        with self.lock:
+            return bool(self._progress or self._logs or self._events)
+
+    def drain(self, max_events):
+        """
+        حداکثر max_events رویداد کنترلی به همراه همه پیشرفت‌های ادغام‌شده و لاگ‌های بافرشده را
+        برمی‌گرداند: (events, progress, logs, dropped_logs).
+        """
+        with self.lock:
+            events = [self._events.popleft() for _ in range(min(max_events, len(self._events)))]
+            progress = list(self._progress.values())
+            self._progress = {}
+            logs = list(self._logs)
+            self._logs.clear()
+            dropped, self._dropped_logs = self._dropped_logs, 0
+        return events, progress, logs, dropped
+
+
 # ==============================================================================
+# بخش ۳: کلاس اصلی برنامه GUI
+# ==============================================================================
+MAX_EVENTS_PER_TICK = 50
+
+
 class AgentGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Agent Control Panel v3.1")
-        self.root.geometry("550x550")
+        self.root.geometry("550x600")
         self.root.resizable(False, False)
         sv_ttk.set_theme("dark")
 
         self.default_font = font.nametofont("TkDefaultFont")
         self.default_font.configure(family="Segoe UI", size=10)
 
-        self.gui_queue = queue.Queue()
+        self.gui_queue = GuiEventPipeline()
         self.mt5 = MT5Manager(self.gui_queue.put)
         self.client = AgentClient(self.gui_queue, self.mt5)
         self.login_number = None
+        self.sync_progress = {}
 
         self.create_widgets()
+        self.preload_cached_symbols()
         self.process_queue()
 
     def create_widgets(self):
@@ -134,6 +245,12 @@ class AgentGUI:
         self.sync_button = ttk.Button(button_container, text="Sync Symbols", command=self.start_sync_thread,
                                       state="disabled")
         self.sync_button.grid(row=0, column=2, padx=5, sticky="ew")
+        self.sync_all_button = ttk.Button(button_container, text="Sync All Rates", command=self.sync_all_rates,
+                                          state="disabled")
+        self.sync_all_button.grid(row=1, column=0, columnspan=2, padx=5, pady=(8, 0), sticky="ew")
+        self.cancel_sync_button = ttk.Button(button_container, text="Cancel Syncs", command=self.cancel_syncs,
+                                             state="disabled")
+        self.cancel_sync_button.grid(row=1, column=2, padx=5, pady=(8, 0), sticky="ew")
 
         # --- بخش جستجوی نماد ---
         search_frame = ttk.LabelFrame(main_frame, text="Symbol Search", padding=(15, 10))
@@ -161,43 +278,91 @@ class AgentGUI:
         self.mt5_status_label.pack(anchor="w", padx=5, pady=2)
 
     def process_queue(self):
+        """
+        در هر tick حداکثر MAX_EVENTS_PER_TICK رویداد کنترلی پردازش می‌شود و پیشرفت و لاگ‌ها
+        فقط یک بار (آخرین وضعیت) روی ویجت‌ها رسم می‌شوند تا رابط کاربری هنگام همگام‌سازی سریع روان بماند.
+        """
         try:
-            while not self.gui_queue.empty():
-                msg = self.gui_queue.get_nowait()
-                if isinstance(msg, dict):
-                    msg_type = msg.get("type")
-                    if msg_type == "progress_update":
-                        self.handle_progress_update(msg)
-                    elif msg_type == "client_ready":
-                        self.login_number = msg.get("login")
-                        self.root.title(f"Agent Control Panel v3.1 - Account: {self.login_number}")
-                        self.start_symbol_fetching()
-                    elif msg_type == "db_symbols_list":
-                        self.handle_db_symbols(msg.get("data", []))
-                    elif msg_type == "log":
-                        self.handle_status_message(msg.get("message"), msg.get("level", "info"))
+            events, progress, logs, dropped = self.gui_queue.drain(MAX_EVENTS_PER_TICK)
+            last_status = None
+            for msg in logs:
+                message, level = msg.get("message"), msg.get("level", "info")
+                if "Kafka Producer Status:" in message or "MT5 Status:" in message:
+                    self.handle_status_message(message, level)
                 else:
-                    self.handle_status_message(str(msg))
+                    last_status = (message, level)
+            if last_status:
+                message, level = last_status
+                if dropped:
+                    message = f"{message} (+{dropped} more messages)"
+                self.handle_status_message(message, level)
+
+            for msg in progress:
+                self.handle_progress_update(msg, render=False)
+            if progress:
+                self.render_progress(progress[-1].get('symbol', 'Symbol List'))
+
+            for msg in events:
+                msg_type = msg.get("type")
+                if msg_type == "sync_finished":
+                    self.handle_sync_finished(msg)
+                elif msg_type == "client_ready":
+                    self.login_number = msg.get("login")
+                    self.root.title(f"Agent Control Panel v3.1 - Account: {self.login_number}")
+                    self.start_symbol_fetching()
+                elif msg_type == "db_symbols_list":
+                    self.handle_db_symbols(msg.get("data", []))
+                elif msg_type == "connection_status":
+                    self.handle_connection_status(msg)
         finally:
-            self.root.after(100, self.process_queue)
-
-    def handle_progress_update(self, msg):
-        current, total = msg.get("current", 0), msg.get("total", 1)
-        if total > 0:
-            percentage = (current / total) * 100
-            self.progress_bar["value"] = percentage
+            # اگر کار باقی مانده باشد tick بعدی زودتر اجرا می‌شود
+            self.root.after(20 if self.gui_queue.pending() else 100, self.process_queue)
+
+    def handle_progress_update(self, msg, render=True):
+        # current = ردیف‌های خوانده‌شده از MT5، acked = ردیف‌هایی که کافکا تایید کرده است
+        label = msg.get('symbol', 'Symbol List')
+        state = self.sync_progress.setdefault(label, {"current": 0, "total": 0, "acked": 0})
+        state.update({key: msg[key] for key in ("current", "total", "acked") if key in msg})
+        if render:
+            self.render_progress(label)
+
+    def render_progress(self, label):
+        state = self.sync_progress.get(label)
+        if not state or state["total"] <= 0:
+            return
+        total = state["total"]
+        percentage = (state["acked"] / total) * 100
+        self.progress_bar["value"] = percentage
+        others = len(self.sync_progress) - 1
+        suffix = f" (+{others} more symbols syncing)" if others > 0 else ""
+        self.progress_label.config(
+            text=f"Syncing '{label}': {state['acked']}/{total} acked, {state['current']} read "
+                 f"({percentage:.2f}%){suffix}")
+
+    def handle_sync_finished(self, msg):
+        label = msg.get('symbol', 'Symbol List')
+        self.sync_progress.pop(label, None)
+        failed = msg.get("failed", 0)
+        spooled = msg.get("spooled", 0)
+        if failed:
+            self.progress_label.config(text=f"Synchronization for '{label}' finished with {failed} failed batches.")
+        elif spooled:
             self.progress_label.config(
-                text=f"Syncing '{msg.get('symbol', 'Symbol List')}': {current}/{total} ({percentage:.2f}%)")
-        if current >= total:
-            self.progress_label.config(text=f"Synchronization complete for '{msg.get('symbol', 'Symbol List')}'!")
-            self.sync_button.config(state="normal")
-            self.symbol_combobox.config(state="normal")
+                text=f"Broker unavailable: {spooled} batches of '{label}' spooled, they will be sent on reconnect.")
+        else:
+            self.progress_bar["value"] = 100
+            self.progress_label.config(text=f"Synchronization complete for '{label}'!")
+        self.sync_button.config(state="normal")
+        self.symbol_combobox.config(state="normal")
+        if not self.client.sync_scheduler.active_count():
+            self.cancel_sync_button.config(state="disabled")
 
     def handle_db_symbols(self, symbols):
         if symbols:
             symbol_names = [s.get('name') for s in symbols if s.get('name')]
             self.symbol_combobox.set_master_list(symbol_names)
             self.symbol_combobox.state(['!disabled'])
+            self.sync_all_button.config(state="normal")
             self.symbol_combobox.set("Search for a symbol...")
         else:
             self.symbol_combobox.set("No symbols found. Please use 'Sync Symbols'.")
@@ -211,10 +376,26 @@ class AgentGUI:
         else:
             self.progress_label.config(text=log_entry)
 
+    def handle_connection_status(self, msg):
+        """وضعیت اتصال کافکا یا متاتریدر را که ConnectionSupervisor گزارش می‌دهد روی برچسب مربوط نشان می‌دهد."""
+        state = "Connected" if msg.get("up") else "Disconnected, reconnecting..."
+        if msg.get("link") == "kafka":
+            self.proxy_status_label.config(text=f"Kafka Producer Status: {state}")
+        elif msg.get("link") == "mt5":
+            self.mt5_status_label.config(text=f"MT5 Status: {state}")
+
     def set_server_addresses(self):
         self.client.set_server_address(self.kafka_entry.get(), self.db_handler_entry.get())
         self.start_button.config(state="normal")
         self.progress_label.config(text="Addresses set. Ready to connect.")
+        self.preload_cached_symbols()
+
+    def preload_cached_symbols(self):
+        """لیست نمادهای کش‌شده را بلافاصله نمایش می‌دهد؛ انتخاب نماد تا زمان اتصال غیرفعال می‌ماند."""
+        cached = self.client.cached_db_symbols()
+        if cached and not self.login_number:
+            self.symbol_combobox.set_master_list([s.get('name') for s in cached if s.get('name')])
+            self.symbol_combobox.set(f"{len(cached)} cached symbols loaded. Connect to sync...")
 
     def start_client(self):
         self.client.start()
@@ -227,6 +408,8 @@ class AgentGUI:
         self.start_button.config(state="normal")
         self.stop_button.config(state="disabled")
         self.sync_button.config(state="disabled")
+        self.sync_all_button.config(state="disabled")
+        self.cancel_sync_button.config(state="disabled")
         self.symbol_combobox.set("Set addresses and connect to load symbols...")
         self.symbol_combobox.state(['disabled'])
         self.symbol_combobox.set_master_list([])
@@ -238,15 +421,17 @@ class AgentGUI:
         threading.Thread(target=self.on_sync_symbols_click, daemon=True).start()
 
     def on_sync_symbols_click(self):
-        self.handle_status_message("Starting symbol list synchronization...")
+        self.gui_queue.put({"type": "log", "level": "info", "message": "Starting symbol list synchronization..."})
 
         def progress_callback(current, total):
             self.gui_queue.put({"type": "progress_update", "current": current, "total": total})
 
-        symbol_generator = self.mt5.get_all_symbols_in_batches(progress_callback)
-        self.client.sync_symbols_in_batches(symbol_generator)
+        def ack_callback(acked):
+            self.gui_queue.put({"type": "progress_update", "acked": acked})
+
+        report = self.client.sync_symbol_catalog(progress_callback, ack_callback)
 
-        self.handle_status_message("Finished syncing symbol list. You can now search.", "info")
+        self.gui_queue.put({"type": "sync_finished", "failed": len(report.errors), "spooled": report.spooled})
         self.start_symbol_fetching()
 
     def start_symbol_fetching(self):
@@ -259,17 +444,22 @@ class AgentGUI:
 
         self.handle_status_message(f"Symbol '{symbol_name}' selected. Fetching historical rates...", "info")
         self.progress_bar["value"] = 0
-        self.symbol_combobox.config(state="disabled")
-        threading.Thread(target=self._fetch_and_sync_rates_in_batches, args=(symbol_name,), daemon=True).start()
+        self.cancel_sync_button.config(state="normal")
+        self.client.sync_scheduler.submit([symbol_name])
 
-    def _fetch_and_sync_rates_in_batches(self, symbol_name):
-        def progress_callback(current, total):
-            self.gui_queue.put({"type": "progress_update", "symbol": symbol_name, "current": current, "total": total})
-
-        rates_generator = self.mt5.get_rates_in_batches(symbol_name, progress_callback)
-        self.client.sync_rates_data_in_batches(symbol_name, rates_generator)
+    def sync_all_rates(self):
+        """همه نمادهای لیست دیتابیس را برای همگام‌سازی موازی به زمان‌بند می‌سپارد."""
+        symbols = list(self.symbol_combobox.master_list)
+        if not symbols:
+            return
+        self.handle_status_message(f"Queued rates sync for {len(symbols)} symbols.", "info")
+        self.progress_bar["value"] = 0
+        self.cancel_sync_button.config(state="normal")
+        self.client.sync_scheduler.submit(symbols)
 
-        self.handle_status_message(f"Finished syncing all batches for {symbol_name}.", "info")
+    def cancel_syncs(self):
+        self.client.sync_scheduler.cancel()
+        self.handle_status_message("Cancelling running synchronizations...", "warning")
 
 
 if __name__ == "__main__":
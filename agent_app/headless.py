@@ -0,0 +1,196 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/headless.py
+# Description: اجرای ایجنت بدون رابط گرافیکی (سرویس / خط فرمان) برای VPS ها.
+# ==================================================================
+import json
+import queue
+import signal
+import threading
+import time
+from logger import setup_logger
+from mt5_manager import MT5Manager
+from server import AgentClient
+
+DEFAULT_SETTINGS = {
+    "kafka_servers": "kafka-broker.liara.run:9092",
+    "db_handler_url": "https://project-db-handler.liara.run",
+    "symbols": "all",           # لیست نمادها یا "all" برای همه نمادهای لیست دیتابیس
+    "sync_symbol_catalog": False,
+    "interval_seconds": 0,      # صفر یعنی فقط یک بار همگام‌سازی و خروج
+    "wire_format": "json",
+    "timeframes": None,         # مثال: ["M1", "M5", "H1", "D1"] برای ساخت چند تایم‌فریم از یک واکشی M1
+    "workers": 4,
+    "connect_timeout": 60,
+    "producer": {},
+    # حجم هدف هر پیام همگام‌سازی و سقف آن؛ مثال: {"target_bytes": 262144, "max_message_bytes": 921600}
+    "batch_budget": {},
+    # "default" یا "symbol" (همه تایم‌فریم‌های یک نماد در یک partition)
+    "partitioner": "default",
+    "per_symbol_catalogue": False,
+    # مثال: {"symbols": ["EURUSD"], "mode": "latest", "flush_interval_ms": 250}
+    "tick_stream": None,
+    # پخش تغییرات حساب، پوزیشن‌ها و سفارش‌ها؛ مثال: {"poll_interval_ms": 500, "snapshot_interval": 60}
+    "state_stream": None,
+    # به‌روزرسانی خودکار پس از بسته شدن هر کندل؛ مثال: {"symbols": "all", "timeframes": ["M1", "H1"]}
+    "refresh": None,
+    # مثال: {"port": 9108, "topic": "agent_metrics", "interval": 15}؛ None یعنی متریک غیرفعال
+    "metrics": None,
+    # آرگومان‌های mt5.initialize برای این ایجنت: {"path": ..., "login": ..., "password": ..., "server": ...}
+    "terminal": None,
+    # کش محلی کندل‌ها؛ {} یعنی فعال با مسیر و سقف حجم config، مثال: {"max_bytes": 1073741824}؛ None یعنی غیرفعال
+    "rates_cache": None,
+}
+
+
+def load_settings(config_path=None, overrides=None):
+    """Merges the defaults, an optional JSON config file and command-line overrides (None values ignored)."""
+    settings = dict(DEFAULT_SETTINGS)
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f))
+    if overrides:
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+    return settings
+
+
+class HeadlessAgent:
+    """
+    Drives MT5Manager and AgentClient without Tk: connects, runs rates syncs on a fixed
+    interval (or once) and shuts down cleanly on SIGINT/SIGTERM.
+    When run under the terminal supervisor, `status_queue` receives state changes and sync
+    results, and `stop_event` may be a multiprocessing.Event shared with the supervisor.
+    """
+
+    def __init__(self, settings, status_queue=None, stop_event=None):
+        self.logger = setup_logger()
+        self.settings = settings
+        self.status_queue = status_queue
+        self.events = queue.Queue()
+        self.stop_event = stop_event or threading.Event()
+        self.ready_event = threading.Event()
+        self.db_symbols = None
+        self.db_symbols_event = threading.Event()
+        self.mt5 = MT5Manager(terminal=settings["terminal"])
+        if settings["rates_cache"] is not None:
+            self.mt5.enable_rates_cache(**settings["rates_cache"])
+        self.client = AgentClient(self.events, self.mt5, sync_workers=settings["workers"])
+        self.client.set_producer_options(**settings["producer"])
+        self.client.set_wire_format(settings["wire_format"])
+        self.client.set_batch_budget(**settings["batch_budget"])
+        self.client.set_partitioning(settings["partitioner"], settings["per_symbol_catalogue"])
+        if settings["metrics"]:
+            self.client.enable_metrics(**settings["metrics"])
+        self.failures = 0
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop_event.set())
+
+    def _report(self, state, **fields):
+        if self.status_queue is not None:
+            self.status_queue.put({"terminal": self.settings.get("name"), "state": state, "time": time.time(), **fields})
+
+    def _pump_events(self, timeout=0.5):
+        """Drains the client's event queue, logging messages and recording state changes."""
+        try:
+            msg = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            msg_type = msg.get("type") if isinstance(msg, dict) else None
+            if msg_type == "log":
+                log_method = getattr(self.logger, msg.get("level", "info"), self.logger.info)
+                log_method(msg.get("message"))
+            elif msg_type == "client_ready":
+                self.ready_event.set()
+                self._report("ready", login=msg.get("login"))
+            elif msg_type == "db_symbols_list":
+                self.db_symbols = [s.get('name') for s in msg.get("data", []) if s.get('name')]
+                self.db_symbols_event.set()
+            elif msg_type == "sync_finished":
+                if msg.get("failed"):
+                    self.failures += 1
+                self.logger.info(f"Sync of {msg.get('symbol', 'symbol list')} finished: "
+                                 f"{msg.get('state', 'done')}, {msg.get('failed', 0)} failed batches")
+                self._report("sync_finished", symbol=msg.get("symbol"), failed=msg.get("failed", 0))
+            try:
+                msg = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _wait_for(self, event, timeout):
+        deadline = time.monotonic() + timeout
+        while not event.is_set() and not self.stop_event.is_set() and time.monotonic() < deadline:
+            self._pump_events()
+        return event.is_set()
+
+    def _resolve_symbols(self, symbols=None):
+        symbols = self.settings["symbols"] if symbols is None else symbols
+        if symbols != "all":
+            return list(symbols)
+        self.db_symbols_event.clear()
+        self.client.request_db_symbols()
+        if not self._wait_for(self.db_symbols_event, self.settings["connect_timeout"]):
+            self.logger.error("Timed out waiting for the symbol list from the DB handler.")
+            return []
+        return self.db_symbols or []
+
+    def run_sync_pass(self):
+        if self.settings["sync_symbol_catalog"]:
+            self.client.sync_symbol_catalog(lambda current, total: None)
+
+        symbols = self._resolve_symbols()
+        self.logger.info(f"Headless sync pass for {len(symbols)} symbols.")
+        started = time.monotonic()
+        self.client.sync_scheduler.submit(symbols, timeframes=self.settings["timeframes"], skip_busy=True)
+        while self.client.sync_scheduler.active_count():
+            if self.stop_event.is_set():
+                self.client.sync_scheduler.cancel()
+            self._pump_events()
+        self._pump_events(timeout=0)
+        self.logger.info(f"Sync pass finished in {time.monotonic() - started:.1f}s.")
+
+    def run(self):
+        """Returns a process exit code: 0 when every sync succeeded."""
+        self.client.set_server_address(self.settings["kafka_servers"], self.settings["db_handler_url"])
+        self.client.start()
+        try:
+            if not self._wait_for(self.ready_event, self.settings["connect_timeout"]):
+                self.logger.error("Agent did not become ready; giving up.")
+                self._report("failed", error="agent did not become ready")
+                return 2
+            tick_stream = self.settings["tick_stream"]
+            if tick_stream:
+                tick_stream = dict(tick_stream)
+                self.client.start_tick_stream(tick_stream.pop("symbols"), **tick_stream)
+            state_stream = self.settings["state_stream"]
+            if state_stream:
+                self.client.start_state_stream(**state_stream)
+            refresh = self.settings["refresh"]
+            interval = self.settings["interval_seconds"]
+            while not self.stop_event.is_set():
+                self._report("syncing")
+                self.run_sync_pass()
+                self._report("idle", failures=self.failures)
+                if refresh and self.client.refresh_scheduler is None:
+                    # به‌روزرسانی خودکار پس از اولین گذر شروع می‌شود تا همان نمادها دو بار از یک watermark همگام نشوند
+                    options = dict(refresh)
+                    self.client.start_refresh(self._resolve_symbols(options.pop("symbols", None)), **options)
+                if not interval and not tick_stream and not state_stream and not refresh:
+                    break
+                if not interval:
+                    # فقط پخش تیک/وضعیت حساب یا به‌روزرسانی خودکار فعال است؛ تا دریافت سیگنال توقف منتظر می‌مانیم
+                    while not self.stop_event.is_set():
+                        self._pump_events()
+                    break
+                next_run = time.monotonic() + interval
+                while not self.stop_event.is_set() and time.monotonic() < next_run:
+                    self._pump_events()
+            return 1 if self.failures else 0
+        finally:
+            self.client.stop_tick_stream()
+            self.client.stop_state_stream()
+            self.client.stop_refresh()
+            self.client.stop()
+            self.client.wait_closed()
+            self._pump_events(timeout=0)
@@ -0,0 +1,68 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/http_cache.py
+# Description: کش روی دیسک پاسخ‌های HTTP با پشتیبانی از درخواست شرطی (ETag / Last-Modified).
+# ==================================================================
+import json
+import os
+import threading
+import logging
+from config import HTTP_CACHE_FILE
+
+
+class ConditionalCache:
+    """
+    Stores the last body of GET responses together with their ETag / Last-Modified
+    validators, so a refresh can be sent as a conditional request and answered with 304.
+    """
+
+    def __init__(self, path=HTTP_CACHE_FILE):
+        self.logger = logging.getLogger("AgentApp")
+        self.path = path
+        self.lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable HTTP cache file {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def get(self, url):
+        """Returns the cached body for `url`, or None."""
+        with self.lock:
+            entry = self._entries.get(url)
+        return entry["data"] if entry else None
+
+    def latest(self, marker):
+        """Returns the body of the most recently stored URL containing `marker`, or None."""
+        with self.lock:
+            candidates = [entry for url, entry in self._entries.items() if marker in url]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda entry: entry.get("stored", 0))["data"]
+
+    def conditional_headers(self, url):
+        """Request headers that let the server answer 304 if the cached body is still current."""
+        with self.lock:
+            entry = self._entries.get(url)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, data, etag=None, last_modified=None, stored=None):
+        with self.lock:
+            self._entries[url] = {"data": data, "etag": etag, "last_modified": last_modified, "stored": stored}
+            self._save()
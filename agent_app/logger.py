@@ -1,12 +1,100 @@
 # C:\...\windows_agent_project\client\agent_app\logger.py
 
+import atexit
+import json
 import logging
+import logging.handlers
 import os
-from config import LOG_FILE
+import queue
+import re
+import threading
+import time
+import config
+
+_listener = None
+
+# ارقام داخل پیام (شماره batch، تعداد، زمان) برای تشخیص پیام‌های تکراری نادیده گرفته می‌شوند
+_DIGITS = re.compile(r'\d+')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """هر رکورد را به صورت یک خط JSON می‌نویسد تا ابزارهای جمع‌آوری لاگ راحت‌تر آن را بخوانند."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    پیام‌های مشابه (با نادیده گرفتن ارقام) را حداکثر `burst` بار در هر `interval` ثانیه عبور می‌دهد.
+    تعداد پیام‌های حذف‌شده به اولین پیام عبوری بعدی اضافه می‌شود.
+    """
+
+    MAX_KEYS = 1000
+
+    def __init__(self, interval, burst=3):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        key = (record.levelno, _DIGITS.sub('#', str(record.msg)))
+        now = time.monotonic()
+        with self.lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) >= self.MAX_KEYS:
+                    self._windows = {k: w for k, w in self._windows.items() if now - w[0] < self.interval}
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+            record.args = None
+        return True
+
+
+def _file_handler():
+    if config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+
+
+def shutdown_logging():
+    """صف لاگ را تخلیه و thread نویسنده را متوقف می‌کند؛ هنگام خروج برنامه خودکار صدا زده می‌شود."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def setup_logger():
-    """لاگر را برای ثبت رویدادها در فایل و کنسول تنظیم می‌کند."""
+    """
+    لاگر را برای ثبت رویدادها در فایل و کنسول تنظیم می‌کند.
+    فراخوانی‌های لاگ فقط رکورد را در صف می‌گذارند و نوشتن روی دیسک در یک thread پس‌زمینه انجام می‌شود،
+    بنابراین thread های همگام‌سازی و MT5 منتظر I/O نمی‌مانند.
+    """
+    global _listener
     logger = logging.getLogger('AgentApp')
 
     # اگر لاگر از قبل handler داشت، دوباره اضافه نمی‌کنیم تا لاگ تکراری نشود
@@ -14,21 +102,32 @@ def setup_logger():
         return logger
 
     # ایجاد دایرکتوری logs اگر وجود نداشته باشد
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(config.LOG_FILE), exist_ok=True)
 
     logger.setLevel(logging.INFO)  # تغییر به INFO برای لاگ‌های کمتر در حالت عادی
 
     # فرمت لاگ
-    log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if config.LOG_FORMAT == 'json':
+        log_format = JsonLinesFormatter()
+    else:
+        log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    # هندلر برای فایل
-    file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+    # هندلر برای فایل (با چرخش بر اساس حجم یا زمان تا فضای دیسک محدود بماند)
+    file_handler = _file_handler()
     file_handler.setFormatter(log_format)
-    logger.addHandler(file_handler)
 
     # هندلر برای کنسول
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_format)
-    logger.addHandler(console_handler)
 
-    return logger
\ No newline at end of file
+    # فقط QueueHandler روی لاگر نصب می‌شود؛ handler های واقعی در QueueListener اجرا می‌شوند
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT_SECONDS))
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    return logger
@@ -1,14 +1,67 @@
 # C:\...\windows_agent_project\client\agent_app\main.py
 
-import tkinter as tk
-from gui import AgentGUI
+import argparse
 
-def main():
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mani FAI MT5 agent")
+    parser.add_argument("--headless", action="store_true", help="run without the Tk window (service / VPS mode)")
+    parser.add_argument("--supervisor", action="store_true",
+                        help='run one headless worker process per entry of "terminals" in the config file')
+    parser.add_argument("--config", help="JSON settings file for headless mode")
+    parser.add_argument("--kafka", dest="kafka_servers", help="Kafka bootstrap servers")
+    parser.add_argument("--db-url", dest="db_handler_url", help="DB handler base URL")
+    parser.add_argument("--symbols", type=lambda value: value if value == "all" else value.split(","),
+                        help='comma-separated symbols, or "all" for the DB symbol list')
+    parser.add_argument("--interval", dest="interval_seconds", type=float,
+                        help="seconds between sync passes; omit or 0 to sync once and exit")
+    parser.add_argument("--wire-format", dest="wire_format", choices=["json", "columnar"])
+    parser.add_argument("--workers", type=int, help="parallel symbol syncs")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on http://127.0.0.1:<port>/metrics")
+    return parser.parse_args(argv)
+
+
+def run_headless(args):
+    # ماژول‌های سنگین فقط در همین مسیر بارگذاری می‌شوند
+    from headless import HeadlessAgent, load_settings
+    overrides = {key: value for key, value in vars(args).items()
+                 if key not in ("headless", "supervisor", "config", "metrics_port")}
+    if args.metrics_port is not None:
+        overrides["metrics"] = {"port": args.metrics_port}
+    agent = HeadlessAgent(load_settings(args.config, overrides))
+    agent.install_signal_handlers()
+    return agent.run()
+
+
+def run_supervisor(args):
+    from headless import load_settings
+    from supervisor import TerminalSupervisor
+    overrides = {key: value for key, value in vars(args).items()
+                 if key not in ("headless", "supervisor", "config", "metrics_port")}
+    if args.metrics_port is not None:
+        overrides["metrics"] = {"port": args.metrics_port}
+    supervisor = TerminalSupervisor(load_settings(args.config, overrides))
+    supervisor.install_signal_handlers()
+    return supervisor.run()
+
+
+def run_gui():
+    import tkinter as tk
+    from gui import AgentGUI
+    root = tk.Tk()
+    app = AgentGUI(root)
+    root.mainloop()
+    return 0
+
+
+def main(argv=None):
     """نقطه ورود اصلی برنامه."""
+    args = parse_args(argv)
     try:
-        root = tk.Tk()
-        app = AgentGUI(root)
-        root.mainloop()
+        if args.supervisor:
+            return run_supervisor(args)
+        return run_headless(args) if args.headless else run_gui()
     except Exception as e:
         # در صورت بروز خطای پیش‌بینی نشده، آن را لاگ می‌کنیم
         # این کار به دیباگ کردن نسخه‌های اجرایی کمک می‌کند
@@ -19,6 +72,7 @@ def main():
         except:
             # اگر حتی لاگر هم کار نکرد، در کنسول چاپ می‌کنیم
             print(f"CRITICAL ERROR: {e}")
+        return 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
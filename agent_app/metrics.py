@@ -0,0 +1,233 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/metrics.py
+# Description: اندازه‌گیری سبک تاخیر و توان عملیاتی مراحل همگام‌سازی و endpoint محلی با فرمت Prometheus.
+# ==================================================================
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import setup_logger
+
+# مرزهای پیش‌فرض histogram بر حسب ثانیه
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_METRICS_PORT = 9108
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class _NullTimer:
+    """Shared no-op context manager returned while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms keyed by name and labels. Every recording method returns
+    immediately while `enabled` is False, so instrumentation left in hot paths costs one
+    attribute check when metrics are off.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_functions = {}
+        self._histograms = {}
+        self._help = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def gauge_function(self, name, function, **labels):
+        """Registers a gauge evaluated at scrape time (e.g. queue depth), so hot paths need no updates."""
+        with self.lock:
+            self._gauge_functions[self._key(name, labels)] = function
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager that observes the elapsed seconds into histogram `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+    def _evaluate_gauges(self):
+        with self.lock:
+            gauges = dict(self._gauges)
+            functions = dict(self._gauge_functions)
+        for key, function in functions.items():
+            try:
+                gauges[key] = function()
+            except Exception:
+                continue
+        return gauges
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        gauges = self._evaluate_gauges()
+        with self.lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.counts), h.total, h.count, h.buckets) for key, h in self._histograms.items()}
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Compact dict form of the current values, for publishing to a metrics topic."""
+        gauges = self._evaluate_gauges()
+        with self.lock:
+            def flat(key):
+                name, labels = key
+                return name + "".join(f"|{k}={v}" for k, v in labels)
+            return {
+                "counters": {flat(key): value for key, value in self._counters.items()},
+                "gauges": {flat(key): value for key, value in gauges.items()},
+                "histograms": {flat(key): {"count": h.count, "sum": h.total} for key, h in self._histograms.items()},
+            }
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("agent_mt5_call_seconds", "Latency of MetaTrader5 API calls")
+METRICS.describe("agent_transform_seconds", "Time spent turning MT5 arrays into batches")
+METRICS.describe("agent_encode_seconds", "Time spent encoding a Kafka message")
+METRICS.describe("agent_encoded_bytes_total", "Bytes handed to the Kafka producer")
+METRICS.describe("agent_kafka_send_wait_seconds", "Time waiting for a free in-flight slot and the producer buffer")
+METRICS.describe("agent_kafka_ack_seconds", "Time from send to broker acknowledgement")
+METRICS.describe("agent_kafka_in_flight", "Messages sent but not yet acknowledged")
+METRICS.describe("agent_handoff_queue_depth", "Encoded batches waiting between sync threads and the event loop")
+
+
+class MetricsServer:
+    """Serves METRICS.render() on http://<host>:<port>/metrics from a daemon thread."""
+
+    def __init__(self, registry=METRICS, host="127.0.0.1", port=DEFAULT_METRICS_PORT):
+        self.logger = setup_logger()
+        self.registry = registry
+        self.address = (host, port)
+        self.httpd = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ("/metrics", ""):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(self.address, Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True).start()
+        self.logger.info(f"Metrics endpoint listening on http://{self.address[0]}:{self.httpd.server_port}/metrics")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
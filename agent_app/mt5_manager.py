@@ -4,8 +4,57 @@
 # ==================================================================
 import MetaTrader5 as mt5
 import logging
-import pandas as pd
-import numpy as np
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from resample import TIMEFRAME_SECONDS, resample_rates, compare_bars
+from metrics import METRICS
+from backoff import Backoff
+
+
+class MT5Worker:
+    """
+    ماژول MetaTrader5 یک API سراسری و غیر thread-safe است؛ این کلاس تنها thread مجاز
+    برای فراخوانی آن را نگه می‌دارد و بقیه thread ها فراخوانی‌ها را به صف آن می‌فرستند.
+    """
+
+    def __init__(self):
+        self._calls = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="MT5Worker", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._calls.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def in_worker_thread(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, func, *args, **kwargs):
+        """فراخوانی را در صف thread متاتریدر قرار می‌دهد و یک Future برمی‌گرداند."""
+        future = Future()
+        self._calls.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """فراخوانی را روی thread متاتریدر اجرا کرده و منتظر نتیجه می‌ماند."""
+        if self.in_worker_thread():
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def stop(self):
+        self._calls.put(None)
 
 
 class MT5Manager:
@@ -13,21 +62,47 @@ class MT5Manager:
     کلاسی برای مدیریت تمام عملیات مربوط به MetaTrader 5.
     """
 
-    def __init__(self, gui_callback=None):
+    def __init__(self, gui_callback=None, terminal=None):
         """
         سازنده کلاس که حالا یک تابع callback برای ارسال پیام به GUI دریافت می‌کند.
+        terminal (اختیاری) دیکشنری آرگومان‌های mt5.initialize است: path، login، password، server، portable، timeout؛
+        بدون آن اولین ترمینال نصب‌شده باز می‌شود.
         """
         self.logger = logging.getLogger("AgentApp")
         self.gui_callback = gui_callback
+        self.default_timeframe = mt5.TIMEFRAME_M1
+        self.terminal = dict(terminal or {})
+        # تلاش‌های دوباره initialize با تاخیر نمایی انجام می‌شوند تا ترمینال قطع‌شده زیر بار درخواست نرود
+        self.reconnect_backoff = Backoff(initial=1.0, maximum=30.0)
+        self._retry_at = 0.0
+        self.rates_cache = None
+        self.worker = MT5Worker()
         try:
-            if not mt5.initialize():
-                self.logger.error(f"initialize() failed, error code = {mt5.last_error()}")
+            if not self._initialize():
+                self.logger.error(f"initialize() failed, error code = {self._call(mt5.last_error)}")
                 raise ConnectionError("Failed to initialize MetaTrader 5")
             self.logger.info("MetaTrader 5 initialized successfully.")
         except Exception as e:
             self.log_message(f"Initialization failed: {e}", "critical")
             raise
 
+    def _call(self, func, *args, **kwargs):
+        """
+        تمام فراخوانی‌های ماژول MetaTrader5 از این مسیر و روی thread اختصاصی MT5Worker انجام می‌شوند.
+        """
+        if not METRICS.enabled:
+            return self.worker.call(func, *args, **kwargs)
+        with METRICS.timer("agent_mt5_call_seconds", call=getattr(func, "__name__", "call")):
+            return self.worker.call(func, *args, **kwargs)
+
+    def _initialize(self):
+        """mt5.initialize را با مسیر و اطلاعات حساب ترمینال انتخاب‌شده صدا می‌زند."""
+        options = dict(self.terminal)
+        path = options.pop("path", None)
+        if path:
+            return self._call(mt5.initialize, path, **options)
+        return self._call(mt5.initialize, **options)
+
     def log_message(self, message, level="info"):
         """
         یک تابع کمکی برای لاگ کردن و ارسال پیام به صف GUI.
@@ -41,12 +116,22 @@ class MT5Manager:
     def connect(self):
         """
         اطمینان حاصل می‌کند که یک اتصال فعال با ترمینال متاتریدر وجود دارد.
+        اگر اتصال قطع باشد، initialize فقط پس از گذشت تاخیر نمایی دوباره امتحان می‌شود و تا آن زمان False برمی‌گردد.
         """
-        if not mt5.terminal_info():
-            self.log_message("No active terminal connection, trying to re-initialize...", "warning")
-            if not mt5.initialize():
-                self.log_message(f"re-initialize() failed, error code = {mt5.last_error()}", "error")
-                return False
+        if self._call(mt5.terminal_info):
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        self.log_message("No active terminal connection, trying to re-initialize...", "warning")
+        if not self._initialize():
+            delay = self.reconnect_backoff.next_delay()
+            self._retry_at = time.monotonic() + delay
+            self.log_message(f"re-initialize() failed, error code = {self._call(mt5.last_error)}; "
+                             f"next attempt in {delay:.1f}s", "error")
+            return False
+        self.reconnect_backoff.reset()
+        self._retry_at = 0.0
+        self.log_message("Reconnected to MetaTrader 5.", "info")
         return True
 
     def get_account_info(self):
@@ -55,75 +140,317 @@ class MT5Manager:
         """
         if not self.connect():
             return None
-        account_info = mt5.account_info()
+        account_info = self._call(mt5.account_info)
         if account_info:
             return account_info._asdict()
         self.log_message("Could not retrieve account info.", "error")
         return None
 
-    def get_all_symbols_in_batches(self, progress_callback, batch_size=500):
+    def get_all_symbols(self):
         """
-        تمام نمادها را به صورت دسته‌ای (batch) واکشی و yield می‌کند تا از ارسال پیام‌های حجیم جلوگیری شود.
+        تمام نمادهای بروکر را به صورت لیست دیکشنری برمی‌گرداند؛ None یعنی خطا و لیست خالی یعنی نمادی پیدا نشد.
         """
         if not self.connect():
-            yield None  # None نشان‌دهنده خطا است
-            return
+            return None
 
-        symbols = mt5.symbols_get()
+        symbols = self._call(mt5.symbols_get)
         if not symbols:
             self.log_message("No symbols found in Market Watch.", "warning")
-            yield []  # لیست خالی یعنی داده‌ای پیدا نشد
-            return
+            return []
+        return [s._asdict() for s in symbols]
+
+    def get_all_symbols_in_batches(self, progress_callback, batch_size=500, symbols_data=None):
+        """
+        تمام نمادها را به صورت دسته‌ای (batch) واکشی و yield می‌کند تا از ارسال پیام‌های حجیم جلوگیری شود.
+        اگر symbols_data داده شود (مثلاً فقط نمادهای تغییرکرده)، همان لیست دسته‌بندی می‌شود.
+        """
+        if symbols_data is None:
+            symbols_data = self.get_all_symbols()
+            if not symbols_data:
+                yield symbols_data  # None نشان‌دهنده خطا و لیست خالی یعنی داده‌ای پیدا نشد
+                return
 
-        symbols_data = [s._asdict() for s in symbols]
         total_symbols = len(symbols_data)
         self.log_message(f"Retrieved {total_symbols} total symbols. Starting batch processing...", "info")
 
-        for i in range(0, total_symbols, batch_size):
-            batch = symbols_data[i:i + batch_size]
-            progress_callback(min(i + batch_size, total_symbols), total_symbols)
+        i = 0
+        while i < total_symbols:
+            batch = symbols_data[i:i + self._batch_rows(batch_size)]
+            i += len(batch)
+            progress_callback(i, total_symbols)
             yield batch
 
+    @staticmethod
+    def _batch_rows(batch_size):
+        """
+        batch_size می‌تواند عدد ثابت یا یک callable (مانند AdaptiveBatcher) باشد که پیش از هر batch
+        تعداد ردیف بعدی را بر اساس حجم پیام‌های قبلی برمی‌گرداند.
+        """
+        return max(1, int(batch_size() if callable(batch_size) else batch_size))
+
+    def _fetch_rates(self, symbol_name, timeframe, total_count, since):
+        """
+        اگر since داده شده باشد فقط کندل‌های جدیدتر از watermark را با copy_rates_range می‌گیرد،
+        در غیر این صورت total_count کندل آخر را واکشی می‌کند.
+        """
+        if since is None:
+            return self._call(mt5.copy_rates_from_pos, symbol_name, timeframe, 0, total_count)
+
+        # ساعت سرور بروکر معمولاً جلوتر از UTC است، پس انتهای بازه را یک روز جلوتر می‌گیریم
+        date_from = datetime.fromtimestamp(since, tz=timezone.utc)
+        date_to = datetime.now(timezone.utc) + timedelta(days=1)
+        rates = self._call(mt5.copy_rates_range, symbol_name, timeframe, date_from, date_to)
+        if rates is None:
+            return None
+        # کندل watermark دوباره ارسال می‌شود چون ممکن است هنگام ارسال قبلی هنوز بسته نشده بوده باشد
+        return rates[rates['time'] >= since]
+
+    def enable_rates_cache(self, directory=None, max_bytes=None):
+        """
+        کش محلی کندل‌ها را فعال می‌کند؛ از این پس get_rates_in_batches و get_multi_timeframe_rates فقط انتهای تازه
+        هر سری را از متاتریدر می‌گیرند و بقیه را از فایل‌های memory-map شده روی دیسک می‌خوانند.
+        """
+        from rates_cache import RatesCache
+        options = {key: value for key, value in (("directory", directory), ("max_bytes", max_bytes)) if value}
+        self.rates_cache = RatesCache(**options)
+        return self.rates_cache
+
+    def _load_rates(self, symbol_name, timeframe, total_count, since):
+        """
+        مانند _fetch_rates، ولی با کش فعال فقط کندل‌های جدیدتر از آخرین کندل کش‌شده (به همراه خود آن کندل که شاید
+        هنوز باز بوده) از ترمینال واکشی و به کش اضافه می‌شوند و نتیجه برشی بدون کپی از فایل کش است.
+        فقط اگر کش به اندازه کافی به عقب نرسد کل بازه دوباره از متاتریدر گرفته می‌شود.
+        """
+        cache = self.rates_cache
+        if cache is None:
+            return self._fetch_rates(symbol_name, timeframe, total_count, since)
+
+        coverage = cache.coverage(symbol_name, timeframe)
+        if coverage is not None:
+            first, last, complete = coverage
+            tail = self._fetch_rates(symbol_name, timeframe, total_count, last)
+            if tail is None:
+                return None
+            cache.store(symbol_name, timeframe, tail)
+            if since is not None and (since >= first or complete):
+                return cache.get(symbol_name, timeframe, start=since)
+            if since is None:
+                cached = cache.get(symbol_name, timeframe)
+                if len(cached) >= total_count or complete:
+                    return cached[-total_count:]
+
+        rates = self._fetch_rates(symbol_name, timeframe, total_count, since)
+        # واکشی بر اساس تعداد که کمتر از total_count کندل برگرداند یعنی کل تاریخچه ترمینال گرفته شده است
+        cache.store(symbol_name, timeframe, rates, complete=since is None and rates is not None
+                    and len(rates) < total_count)
+        return rates
+
     def get_rates_in_batches(self, symbol_name, progress_callback, timeframe=mt5.TIMEFRAME_M1, total_count=100000,
-                             batch_size=5000):
+                             batch_size=5000, since=None, raw=False):
         """
         داده‌های کندل را به صورت دسته‌ای (batch) واکشی، پردازش و yield می‌کند.
+        با مقدار since (زمان epoch آخرین کندل ارسال‌شده) فقط کندل‌های جدید واکشی می‌شوند.
+        با raw=True برش‌هایی از آرایه ساخت‌یافته NumPy خود MT5 بدون تبدیل pandas برگردانده می‌شوند؛
+        اگر کش کندل‌ها فعال باشد این برش‌ها مستقیماً view هایی از فایل memory-map شده هستند.
         """
         if not self.connect():
             yield None
             return
 
         try:
-            rates = mt5.copy_rates_from_pos(symbol_name, timeframe, 0, total_count)
+            rates = self._load_rates(symbol_name, timeframe, total_count, since)
+            if since is not None and rates is not None and len(rates) == 0:
+                self.log_message(f"{symbol_name} is already up to date.", "info")
+                progress_callback(0, 0)
+                yield []
+                return
             if rates is None or len(rates) == 0:
-                self.log_message(f"Could not retrieve rates for {symbol_name}, error: {mt5.last_error()}", "warning")
+                self.log_message(f"Could not retrieve rates for {symbol_name}, error: {self._call(mt5.last_error)}",
+                                 "warning")
                 yield []
                 return
 
-            rates_frame = pd.DataFrame(rates)
-            rates_frame['time_real'] = pd.to_datetime(rates_frame['time'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
-            for col in ['open', 'high', 'low', 'close']:
-                rates_frame[col] = rates_frame[col].astype(float)
-            for col in ['tick_volume', 'spread', 'real_volume']:
-                rates_frame[col] = rates_frame[col].astype(int)
+            if raw:
+                self.log_message(f"Retrieved {len(rates)} total rates for {symbol_name}. Starting batch processing...",
+                                 "info")
+                yield from self.iter_array_batches(rates, batch_size, progress_callback)
+                return
+
+            # pandas فقط در مسیر سازگاری JSON لازم است و با تاخیر بارگذاری می‌شود
+            import pandas as pd
+            with METRICS.timer("agent_transform_seconds", stage="frame"):
+                rates_frame = pd.DataFrame(rates)
+                rates_frame['time_real'] = pd.to_datetime(rates_frame['time'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
+                for col in ['open', 'high', 'low', 'close']:
+                    rates_frame[col] = rates_frame[col].astype(float)
+                for col in ['tick_volume', 'spread', 'real_volume']:
+                    rates_frame[col] = rates_frame[col].astype(int)
 
             total_rates = len(rates_frame)
             self.log_message(f"Retrieved {total_rates} total rates for {symbol_name}. Starting batch processing...",
                              "info")
 
-            for i in range(0, total_rates, batch_size):
-                batch_df = rates_frame.iloc[i:i + batch_size]
-                batch_data = batch_df.to_dict('records')
-                progress_callback(min(i + batch_size, total_rates), total_rates)
+            i = 0
+            while i < total_rates:
+                with METRICS.timer("agent_transform_seconds", stage="records"):
+                    batch_data = rates_frame.iloc[i:i + self._batch_rows(batch_size)].to_dict('records')
+                i += len(batch_data)
+                progress_callback(i, total_rates)
                 yield batch_data
 
         except Exception as e:
             self.log_message(f"An exception occurred while fetching rates for {symbol_name}: {e}", "error")
             yield None
 
+    @staticmethod
+    def iter_array_batches(rates, batch_size, progress_callback, offset=0, total=None):
+        """
+        برش‌هایی از یک آرایه ساخت‌یافته را yield می‌کند؛ offset و total برای گزارش پیشرفت چند آرایه پشت‌سرهم است.
+        """
+        total = len(rates) if total is None else total
+        i = 0
+        while i < len(rates):
+            batch = rates[i:i + MT5Manager._batch_rows(batch_size)]
+            i += len(batch)
+            progress_callback(offset + i, total)
+            yield batch
+
+    @staticmethod
+    def timeframe_from_name(name):
+        """نام تایم‌فریم (مثلاً "H1") را به ثابت متناظر MetaTrader5 تبدیل می‌کند."""
+        return getattr(mt5, f"TIMEFRAME_{name}")
+
+    def get_multi_timeframe_rates(self, symbol_name, timeframes, total_count=100000, since=None, verify=False):
+        """
+        کندل‌های M1 را فقط یک بار واکشی کرده و تایم‌فریم‌های بالاتر را به صورت برداری از آن می‌سازد.
+        خروجی دیکشنری {نام تایم‌فریم: آرایه ساخت‌یافته} است؛ None یعنی خطا.
+        با verify=True نتیجه با کندل‌های بومی MT5 در همان بازه مقایسه و در لاگ گزارش می‌شود.
+        """
+        if not self.connect():
+            return None
+        unknown = [name for name in timeframes if name not in TIMEFRAME_SECONDS]
+        if unknown:
+            raise ValueError(f"Cannot derive timeframes {unknown} from M1 bars")
+
+        if since is not None:
+            # شروع بازه به ابتدای بزرگ‌ترین تایم‌فریم گرد می‌شود تا اولین کندل مشتق‌شده کامل باشد
+            largest = max(TIMEFRAME_SECONDS[name] for name in timeframes)
+            since -= since % largest
+        m1_rates = self._load_rates(symbol_name, mt5.TIMEFRAME_M1, total_count, since)
+        if m1_rates is None:
+            self.log_message(f"Could not retrieve M1 rates for {symbol_name}, error: {self._call(mt5.last_error)}",
+                             "warning")
+            return None
+
+        derived = {}
+        for name in timeframes:
+            seconds = TIMEFRAME_SECONDS[name]
+            with METRICS.timer("agent_transform_seconds", stage="resample"):
+                # با since شروع بازه هم‌تراز شده است و اولین سطل کامل است، حتی اگر اولین کندل M1 دقیقاً در ابتدای آن نباشد
+                derived[name] = m1_rates if seconds == 60 else resample_rates(m1_rates, seconds,
+                                                                               drop_partial_head=since is None)
+            if verify and seconds != 60 and len(derived[name]):
+                self._verify_derived(symbol_name, name, derived[name])
+        return derived
+
+    def _verify_derived(self, symbol_name, name, bars):
+        date_from = datetime.fromtimestamp(int(bars['time'][0]), tz=timezone.utc)
+        date_to = datetime.fromtimestamp(int(bars['time'][-1]), tz=timezone.utc)
+        native = self._call(mt5.copy_rates_range, symbol_name, self.timeframe_from_name(name), date_from, date_to)
+        if native is None or len(native) == 0:
+            self.log_message(f"Could not fetch native {name} bars of {symbol_name} for verification.", "warning")
+            return
+        compared, mismatches = compare_bars(bars, native)
+        if mismatches:
+            self.log_message(f"Derived {name} bars of {symbol_name} differ from MT5 on {len(mismatches)}/{compared} "
+                             f"bars (first at {mismatches[0]}).", "warning")
+        else:
+            self.log_message(f"Derived {name} bars of {symbol_name} match MT5 on {compared} bars.", "info")
+
+    def _last_ticks(self, symbols):
+        ticks = {}
+        for symbol_name in symbols:
+            tick = mt5.symbol_info_tick(symbol_name)
+            if tick is not None:
+                ticks[symbol_name] = tick._asdict()
+        return ticks
+
+    def get_last_ticks(self, symbols):
+        """
+        آخرین تیک هر نماد را با symbol_info_tick برمی‌گرداند؛ کل حلقه در یک فراخوانی روی thread متاتریدر اجرا می‌شود.
+        """
+        return self.worker.call(self._last_ticks, symbols)
+
+    def _ticks_since(self, cursors, max_count):
+        ticks = {}
+        for symbol_name, from_msc in cursors.items():
+            date_from = datetime.fromtimestamp(from_msc / 1000, tz=timezone.utc)
+            batch = mt5.copy_ticks_from(symbol_name, date_from, max_count, mt5.COPY_TICKS_ALL)
+            if batch is None or len(batch) == 0:
+                continue
+            batch = batch[batch['time_msc'] > from_msc]
+            if len(batch):
+                ticks[symbol_name] = batch
+        return ticks
+
+    def get_ticks_since(self, cursors, max_count=1000):
+        """
+        برای هر نماد در cursors ({symbol: time_msc}) تیک‌های جدیدتر از آن زمان را با copy_ticks_from برمی‌گرداند.
+        """
+        return self.worker.call(self._ticks_since, cursors, max_count)
+
+    @staticmethod
+    def _trading_state():
+        return mt5.account_info(), mt5.positions_get(), mt5.orders_get()
+
+    def get_trading_state(self):
+        """
+        account_info، positions_get و orders_get را در یک فراخوانی روی thread متاتریدر می‌خواند و namedtupleهای خام
+        (account, positions, orders) را برمی‌گرداند؛ اگر هر کدام خطا بدهد None برمی‌گردد تا خطا با «بسته شدن همه
+        پوزیشن‌ها» اشتباه نشود.
+        """
+        account, positions, orders = self.worker.call(self._trading_state)
+        if account is None or positions is None or orders is None:
+            return None
+        return account, positions, orders
+
+    def iter_tick_history(self, symbol_name, start_msc, end_msc, target_ticks=100000, window_seconds=3600,
+                          min_window_seconds=10, max_window_seconds=7 * 86400):
+        """
+        تاریخچه تیک بازه [start_msc, end_msc) را در پنجره‌های زمانی پشت‌سرهم با copy_ticks_range می‌خواند و
+        برای هر پنجره (پایان پنجره به میلی‌ثانیه، آرایه تیک‌ها) را yield می‌کند.
+        طول پنجره بعدی طوری تنظیم می‌شود که هر واکشی حدود target_ticks تیک داشته باشد؛ پنجره‌ای که بیش از
+        چهار برابر آن تیک داشته باشد با طول نصف دوباره خوانده می‌شود، پس حافظه مستقل از طول کل بازه است.
+        در صورت خطا None به جای آرایه yield شده و پیمایش متوقف می‌شود.
+        """
+        if not self.connect():
+            yield end_msc, None
+            return
+        window = window_seconds
+        cursor = start_msc
+        while cursor < end_msc:
+            window_end = min(cursor + int(window * 1000), end_msc)
+            date_from = datetime.fromtimestamp(cursor / 1000, tz=timezone.utc)
+            date_to = datetime.fromtimestamp(window_end / 1000, tz=timezone.utc)
+            ticks = self._call(mt5.copy_ticks_range, symbol_name, date_from, date_to, mt5.COPY_TICKS_ALL)
+            if ticks is None:
+                self.log_message(f"Could not retrieve ticks for {symbol_name}, error: {self._call(mt5.last_error)}",
+                                 "warning")
+                yield window_end, None
+                return
+            if len(ticks) > 4 * target_ticks and window > min_window_seconds:
+                window = max(window / 2, min_window_seconds)
+                continue
+            # انتهای پنجره باز است تا تیک‌های مرزی در دو پنجره تکرار نشوند
+            ticks = ticks[(ticks['time_msc'] >= cursor) & (ticks['time_msc'] < window_end)]
+            yield window_end, ticks
+            cursor = window_end
+            scale = target_ticks / len(ticks) if len(ticks) else 4.0
+            window = min(max(window * min(max(scale, 0.25), 4.0), min_window_seconds), max_window_seconds)
+
     def disconnect(self):
         """
         اتصال با ترمینال متاتریدر را قطع می‌کند.
         """
-        mt5.shutdown()
+        self._call(mt5.shutdown)
         self.log_message("Disconnected from MetaTrader 5.", "info")
@@ -0,0 +1,70 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/partitioning.py
+# Description: کلید، header و partitioner پیام‌های کافکا تا مصرف‌کننده‌ها بتوانند به ازای هر نماد موازی شوند.
+# ==================================================================
+from collections import namedtuple
+
+# نسخه ساختار پیام‌ها؛ با هر تغییر ناسازگار در payload افزایش می‌یابد
+SCHEMA_VERSION = 1
+
+
+class KeyedMessage(namedtuple("KeyedMessage", "value key headers")):
+    """An encoded message value with its Kafka key (bytes or None) and headers ([(name, bytes)] or None)."""
+    __slots__ = ()
+
+    def __new__(cls, value, key=None, headers=None):
+        return super().__new__(cls, value, key, headers)
+
+
+def message_key(login, *parts):
+    """Deterministic key "login|part|...", e.g. (login, symbol, timeframe) for rates or (login, symbol) for symbols."""
+    return "|".join(str(part) for part in (login, *parts)).encode('utf-8')
+
+
+def message_headers(message_type, codec=None, sequence=None, **extra):
+    """
+    Headers consumers can route or filter on without decoding the payload: message type, schema
+    version, codec name and the batch sequence number within its sync run, plus any `extra` fields.
+    """
+    headers = [("type", message_type), ("schema", SCHEMA_VERSION)]
+    if codec is not None:
+        headers.append(("codec", codec))
+    if sequence is not None:
+        headers.append(("seq", sequence))
+    headers.extend(extra.items())
+    return [(name, str(value).encode('utf-8')) for name, value in headers]
+
+
+class SymbolPartitioner:
+    """
+    Hashes only the "login|symbol" prefix of a key, so every timeframe, tick batch and catalogue
+    entry of one symbol lands on the same partition (and stays ordered for one consumer).
+    Messages without a key are spread like the default partitioner does.
+    """
+
+    def __init__(self):
+        from aiokafka.partitioner import DefaultPartitioner, murmur2
+        self._default = DefaultPartitioner()
+        self._murmur2 = murmur2
+
+    def __call__(self, key, all_partitions, available):
+        if key is None:
+            return self._default(key, all_partitions, available)
+        prefix = b"|".join(key.split(b"|")[:2])
+        return all_partitions[(self._murmur2(prefix) & 0x7FFFFFFF) % len(all_partitions)]
+
+
+# "default" یعنی partitioner خود aiokafka (murmur2 روی کل کلید، مانند کلاینت جاوا)
+PARTITIONERS = {
+    "default": None,
+    "symbol": SymbolPartitioner,
+}
+
+
+def get_partitioner(name):
+    """Returns a partitioner instance for the producer, or None for the client default."""
+    try:
+        factory = PARTITIONERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown partitioner '{name}', expected one of {sorted(PARTITIONERS)}") from None
+    return factory() if factory else None
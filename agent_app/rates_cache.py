@@ -0,0 +1,198 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/rates_cache.py
+# Description: کش محلی کندل‌ها روی دیسک (فایل‌های ستونی memory-map شده برای هر نماد و تایم‌فریم) تا ارسال دوباره بدون متاتریدر انجام شود.
+# ==================================================================
+import json
+import os
+import re
+import threading
+import time
+import logging
+import numpy as np
+from config import RATES_CACHE_DIR, RATES_CACHE_MAX_BYTES
+
+INDEX_FILE = "index.json"
+DATA_SUFFIX = ".bin"
+
+
+class RatesCache:
+    """
+    On-disk cache of MT5 rates, one file of fixed-size records (the terminal's own structured
+    dtype) per (symbol, timeframe), read back through np.memmap. Bars are kept sorted by time, so
+    the `time` column is the index: range queries are two binary searches and return zero-copy
+    views that can be sliced straight into encoded batches.
+
+    `store()` merges a freshly fetched range. A range that starts inside the cached one (the usual
+    incremental tail, which re-fetches the still-open last bar) is written in place from that bar
+    on and the file only grows; a range that starts earlier, or leaves a gap after the cached one,
+    replaces the series in a new file generation so readers of the old file are never disturbed.
+    The cached range is therefore always contiguous. When the files exceed `max_bytes`, the least
+    recently used series are evicted.
+    """
+
+    def __init__(self, directory=RATES_CACHE_DIR, max_bytes=RATES_CACHE_MAX_BYTES):
+        self.logger = logging.getLogger("AgentApp")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._entries = self._load()
+        self._remove_orphans()
+
+    # ------------------------------------------------------------------ state on disk
+    @staticmethod
+    def _key(symbol, timeframe):
+        return f"{symbol}|{int(timeframe)}"
+
+    def _path(self, key, generation):
+        symbol, timeframe = key.rsplit('|', 1)
+        # نام نماد ممکن است کاراکترهای غیرمجاز در نام فایل (مانند / یا #) داشته باشد
+        safe = re.sub(r'[^A-Za-z0-9._-]', lambda m: f"%{ord(m.group()):02X}", symbol)
+        return os.path.join(self.directory, f"{safe}_{timeframe}.{generation}{DATA_SUFFIX}")
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable rates cache index in {self.directory}: {e}")
+            return {}
+
+    def _save(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(path + '.tmp', path)
+
+    def _remove_orphans(self):
+        """Deletes data files that no index entry points at (old generations, evicted series)."""
+        current = {os.path.basename(self._path(key, entry["generation"])) for key, entry in self._entries.items()}
+        for name in os.listdir(self.directory):
+            if name.endswith(DATA_SUFFIX) and name not in current:
+                self._remove_file(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # در ویندوز فایلی که هنوز map شده حذف نمی‌شود؛ در شروع بعدی پاک می‌شود
+
+    @staticmethod
+    def _dtype(entry):
+        return np.lib.format.descr_to_dtype(entry["dtype"])
+
+    def _open(self, key, entry):
+        dtype = self._dtype(entry)
+        if entry["rows"] == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(key, entry["generation"]), dtype=dtype, mode='r', shape=(entry["rows"],))
+
+    def _write(self, key, entry, rates, start_row):
+        path = self._path(key, entry["generation"])
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.seek(start_row * rates.dtype.itemsize)
+            f.write(np.ascontiguousarray(rates).tobytes())
+        entry["rows"] = start_row + len(rates)
+
+    # ------------------------------------------------------------------ public API
+    def get(self, symbol, timeframe, start=None, end=None):
+        """
+        Cached bars with start <= time <= end (both optional) as a read-only memmap view,
+        or None if the series is not cached.
+        """
+        key = self._key(symbol, timeframe)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            rates = self._open(key, entry)
+        times = rates['time']
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        last = len(rates) if end is None else int(np.searchsorted(times, end, side='right'))
+        return rates[first:last]
+
+    def coverage(self, symbol, timeframe):
+        """
+        (first bar time, last bar time, complete) of the cached series, or None. `complete` means
+        the series starts at the oldest bar the terminal had, so nothing older can be fetched.
+        """
+        with self.lock:
+            entry = self._entries.get(self._key(symbol, timeframe))
+            if entry is None or entry["rows"] == 0:
+                return None
+            return entry["first"], entry["last"], entry.get("complete", False)
+
+    def store(self, symbol, timeframe, rates, complete=False):
+        """
+        Merges `rates` (sorted by time, as returned by MT5) into the cached series; `complete`
+        marks a range that starts at the terminal's oldest bar.
+        """
+        if rates is None or len(rates) == 0:
+            return
+        key = self._key(symbol, timeframe)
+        new_first, new_last = int(rates['time'][0]), int(rates['time'][-1])
+        with self.lock:
+            previous = entry = self._entries.get(key)
+            if entry is not None and self._dtype(entry) != rates.dtype:
+                entry = None  # ساختار داده ترمینال عوض شده؛ سری از نو ساخته می‌شود
+            if entry is not None and entry["rows"] and entry["first"] <= new_first <= entry["last"]:
+                cached = self._open(key, entry)
+                start_row = int(np.searchsorted(cached['time'], new_first, side='left'))
+                del cached
+                self._write(key, entry, rates, start_row)
+                entry["complete"] = entry.get("complete", False) or complete
+            else:
+                generation = previous["generation"] + 1 if previous is not None else 0
+                if entry is not None and entry["rows"] and new_first < entry["first"] <= new_last:
+                    # بازه جدید قدیمی‌تر است ولی به داده کش‌شده می‌رسد؛ انتهای کش که جدیدتر است حفظ می‌شود
+                    cached = self._open(key, entry)
+                    rates = np.concatenate([rates, cached[cached['time'] > new_last]])
+                    del cached
+                entry = {"generation": generation, "dtype": np.lib.format.dtype_to_descr(rates.dtype),
+                         "itemsize": rates.dtype.itemsize, "rows": 0, "first": int(rates['time'][0]),
+                         "complete": complete}
+                self._write(key, entry, rates, 0)
+                if previous is not None:
+                    self._remove_file(self._path(key, previous["generation"]))
+            entry["last"] = int(rates['time'][-1])
+            entry["last_used"] = time.time()
+            self._entries[key] = entry
+            self._evict(keep=key)
+            self._save()
+
+    def size_bytes(self):
+        with self.lock:
+            return sum(self._entry_bytes(entry) for entry in self._entries.values())
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return entry["rows"] * entry["itemsize"]
+
+    def _evict(self, keep=None):
+        total = sum(self._entry_bytes(entry) for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            total -= self._entry_bytes(entry)
+            self._remove_file(self._path(key, entry["generation"]))
+            self.logger.info(f"Evicted cached rates of {key} from the rates cache.")
+
+    def invalidate(self, symbol, timeframe=None):
+        """Drops a symbol's cached series (optionally only one timeframe), e.g. after a broker history correction."""
+        with self.lock:
+            for key in list(self._entries):
+                k_symbol, k_timeframe = key.rsplit('|', 1)
+                if k_symbol != symbol or (timeframe is not None and k_timeframe != str(int(timeframe))):
+                    continue
+                entry = self._entries.pop(key)
+                self._remove_file(self._path(key, entry["generation"]))
+            self._save()
@@ -0,0 +1,147 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/refresh_scheduler.py
+# Description: به‌روزرسانی خودکار نمادهای دنبال‌شده بلافاصله پس از بسته شدن هر کندل، با پخش زمانی و اولویت نمادهای عقب‌افتاده.
+# ==================================================================
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import zlib
+from logger import setup_logger
+from resample import TIMEFRAME_SECONDS
+
+DEFAULT_CLOSE_DELAY = 2.0   # چند ثانیه پس از بسته شدن کندل، تا بروکر آخرین تیک‌ها را ثبت کند
+DEFAULT_JITTER = 0.5
+MAX_SPREAD_SECONDS = 30.0
+# نمادی که آخرین کندل ارسالی‌اش از این تعداد کندل عقب‌تر باشد فوری حساب می‌شود
+STALE_BARS = 3
+
+
+class RefreshScheduler:
+    """
+    Runs on the AgentClient background loop and submits an incremental rates sync for every
+    tracked symbol right after each bar of a subscribed timeframe closes.
+
+    Routine refreshes are staggered over `spread` seconds after the close (a stable per-symbol
+    offset derived from the symbol name, plus random `jitter`), so hundreds of symbols do not hit
+    MT5 and Kafka in the same second. Symbols whose watermark is more than STALE_BARS bars behind,
+    or that were never synced, go to an urgent queue that is always served first. At most
+    `max_concurrent` refreshes are handed to the SyncScheduler at once.
+    `server_offset` is the broker server's UTC offset in seconds, used to align H4/D1 closes.
+    """
+
+    def __init__(self, client, symbols, timeframes=("M1",), close_delay=DEFAULT_CLOSE_DELAY, spread=None,
+                 jitter=DEFAULT_JITTER, server_offset=0, max_concurrent=None):
+        if not timeframes:
+            raise ValueError("RefreshScheduler needs at least one timeframe")
+        unknown = [name for name in timeframes if name not in TIMEFRAME_SECONDS]
+        if unknown:
+            raise ValueError(f"Unknown timeframes {unknown}, expected some of {sorted(TIMEFRAME_SECONDS)}")
+        self.logger = setup_logger()
+        self.client = client
+        self.symbols = list(symbols)
+        self.timeframes = tuple(timeframes)
+        self.close_delay = close_delay
+        self.spread = spread
+        self.jitter = jitter
+        self.server_offset = server_offset
+        self.max_concurrent = max_concurrent or client.sync_scheduler.workers
+        self.constants = {name: client.mt5.timeframe_from_name(name) for name in self.timeframes}
+        self.stopped = False
+        self._urgent = []
+        self._routine = []
+        self._pending = {}   # (symbol, timeframe name) -> "urgent" | "routine"
+        self._running = []
+        self._sequence = itertools.count()
+        self._next_close = {}
+        self.refreshes = 0
+
+    def set_symbols(self, symbols):
+        """Replaces the tracked set; takes effect from the next bar close."""
+        self.symbols = list(symbols)
+
+    def stop(self):
+        self.stopped = True
+
+    def _next_close_after(self, name, now):
+        seconds = TIMEFRAME_SECONDS[name]
+        server_now = now + self.server_offset
+        return (server_now // seconds + 1) * seconds - self.server_offset
+
+    def _spread_for(self, name):
+        if self.spread is not None:
+            return self.spread
+        return min(TIMEFRAME_SECONDS[name] / 4, MAX_SPREAD_SECONDS)
+
+    def _is_stale(self, symbol, name, close_time):
+        mark = self.client.watermarks.get(self.client.login_number, symbol, self.constants[name])
+        # watermark زمان کندل به وقت سرور بروکر است و close_time به UTC
+        return mark is None or close_time + self.server_offset - mark > STALE_BARS * TIMEFRAME_SECONDS[name]
+
+    def _enqueue_close(self, name, close_time):
+        spread = self._spread_for(name)
+        base = close_time + self.close_delay
+        for symbol in self.symbols:
+            key = (symbol, name)
+            if self._is_stale(symbol, name, close_time):
+                if self._pending.get(key) == "urgent":
+                    continue
+                self._pending[key] = "urgent"
+                heapq.heappush(self._urgent, (base, next(self._sequence), key))
+            elif key not in self._pending:
+                offset = (zlib.crc32(symbol.encode('utf-8')) % 1000) / 1000 * spread
+                due = base + offset + random.uniform(0, self.jitter)
+                self._pending[key] = "routine"
+                heapq.heappush(self._routine, (due, next(self._sequence), key))
+
+    def _pop_due(self, now):
+        for queue, kind in ((self._urgent, "urgent"), (self._routine, "routine")):
+            while queue and queue[0][0] <= now:
+                _, _, key = heapq.heappop(queue)
+                # یک نماد روتین که در این فاصله فوری شده فقط از صف فوری برداشته می‌شود
+                if self._pending.get(key) == kind:
+                    del self._pending[key]
+                    return key
+        return None
+
+    def _dispatch(self, now):
+        self._running = [job for job in self._running if not job.finished]
+        while len(self._running) < self.max_concurrent:
+            key = self._pop_due(now)
+            if key is None:
+                return
+            symbol, name = key
+            # نمادی که همین حالا (مثلاً در گذر همگام‌سازی کامل) در حال همگام‌سازی است دوباره فرستاده نمی‌شود
+            self._running.extend(self.client.sync_scheduler.submit([symbol], timeframe=self.constants[name],
+                                                                   skip_busy=True))
+            self.refreshes += 1
+
+    def _next_wake(self, now):
+        candidates = list(self._next_close.values())
+        if self._urgent:
+            candidates.append(self._urgent[0][0])
+        if self._routine:
+            candidates.append(self._routine[0][0])
+        # وقتی ظرفیت پر است، برای آزاد شدن یک جای خالی زودتر بیدار می‌شویم
+        wake = min(candidates) - now
+        if len(self._running) >= self.max_concurrent:
+            wake = min(wake, 0.2)
+        return max(0.05, min(wake, 1.0))
+
+    async def run(self):
+        now = time.time()
+        self._next_close = {name: self._next_close_after(name, now) for name in self.timeframes}
+        # نمادهای عقب‌افتاده بدون منتظر ماندن برای اولین بسته شدن کندل به‌روز می‌شوند
+        for name in self.timeframes:
+            self._enqueue_close(name, now - self.close_delay)
+        self.logger.info(f"Bar-close refresh started for {len(self.symbols)} symbols on {', '.join(self.timeframes)}.")
+        while self.client.running and not self.stopped:
+            now = time.time()
+            for name, close_time in self._next_close.items():
+                if now >= close_time:
+                    self._enqueue_close(name, close_time)
+                    self._next_close[name] = self._next_close_after(name, now)
+            self._dispatch(now)
+            await asyncio.sleep(self._next_wake(now))
+        self.logger.info(f"Bar-close refresh stopped after {self.refreshes} refreshes.")
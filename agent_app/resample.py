@@ -0,0 +1,70 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/resample.py
+# Description: ساخت کندل‌های تایم‌فریم بالاتر از کندل‌های M1 به صورت برداری (NumPy).
+# ==================================================================
+import numpy as np
+
+# طول هر تایم‌فریم بر حسب ثانیه؛ W1 و MN1 به دلیل مرز غیر ثابت پشتیبانی نمی‌شوند
+TIMEFRAME_SECONDS = {
+    "M1": 60,
+    "M5": 300,
+    "M15": 900,
+    "M30": 1800,
+    "H1": 3600,
+    "H4": 4 * 3600,
+    "D1": 24 * 3600,
+}
+DERIVED_TIMEFRAMES = ("M1", "M5", "M15", "H1", "H4", "D1")
+
+
+def resample_rates(rates, seconds, spread="min", drop_partial_head=True):
+    """
+    Aggregates a time-sorted MT5 rates array (M1 or any finer timeframe) into bars of
+    `seconds`, aligned to multiples of the period in server time (so D1 starts at midnight).
+
+    open/close are the first/last values of each bucket, high/low the max/min, tick_volume
+    and real_volume are summed and spread is aggregated with "min", "max" or "last".
+    With `drop_partial_head` the first bucket is dropped when the input starts inside it,
+    since its open/high/low would be built from incomplete data.
+    """
+    if len(rates) == 0:
+        return rates[:0]
+    times = rates['time']
+    buckets = times - times % seconds
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [len(rates)])) - 1
+
+    bars = np.empty(len(starts), dtype=rates.dtype)
+    bars['time'] = buckets[starts]
+    bars['open'] = rates['open'][starts]
+    bars['high'] = np.maximum.reduceat(rates['high'], starts)
+    bars['low'] = np.minimum.reduceat(rates['low'], starts)
+    bars['close'] = rates['close'][ends]
+    bars['tick_volume'] = np.add.reduceat(rates['tick_volume'], starts)
+    bars['real_volume'] = np.add.reduceat(rates['real_volume'], starts)
+    if spread == "min":
+        bars['spread'] = np.minimum.reduceat(rates['spread'], starts)
+    elif spread == "max":
+        bars['spread'] = np.maximum.reduceat(rates['spread'], starts)
+    elif spread == "last":
+        bars['spread'] = rates['spread'][ends]
+    else:
+        raise ValueError(f"Unknown spread aggregation '{spread}'")
+
+    if drop_partial_head and times[0] != buckets[0]:
+        bars = bars[1:]
+    return bars
+
+
+def compare_bars(derived, native, price_tolerance=1e-9):
+    """
+    Compares derived bars with MT5's native bars on the timestamps both contain.
+    Returns (compared count, list of mismatching bar times).
+    """
+    common, derived_index, native_index = np.intersect1d(derived['time'], native['time'], return_indices=True)
+    a, b = derived[derived_index], native[native_index]
+    mismatch = np.zeros(len(common), dtype=bool)
+    for field in ('open', 'high', 'low', 'close'):
+        mismatch |= np.abs(a[field] - b[field]) > price_tolerance
+    mismatch |= a['tick_volume'] != b['tick_volume']
+    return len(common), common[mismatch].tolist()
@@ -3,29 +3,192 @@
 # Description: این کلاس دیگر از WebSocket استفاده نمی‌کند و مستقیماً به کافکا متصل می‌شود.
 # ==================================================================
 import asyncio
+import concurrent.futures
 import threading
 import json
-import aiohttp
-import schedule
 import time
-import pytz
 from functools import partial
-from aiokafka import AIOKafkaProducer
+import numpy as np
+from config import TICK_CHECKPOINT_FILE
 from logger import setup_logger
+from watermarks import WatermarkStore
+from wire_format import get_codec
+from resample import DERIVED_TIMEFRAMES
+from sync_engine import SyncScheduler, DEFAULT_SYNC_WORKERS
+from tick_stream import TickStreamer
+from state_stream import StatePublisher
+from refresh_scheduler import RefreshScheduler
+from connection_supervisor import ConnectionSupervisor
+from backoff import Backoff
+from spool import MessageSpool
+from symbol_catalog import SymbolCatalogState
+from http_cache import ConditionalCache
+from metrics import METRICS, MetricsServer, DEFAULT_METRICS_PORT
+from batch_sizing import AdaptiveBatcher, DEFAULT_TARGET_BYTES, DEFAULT_MAX_MESSAGE_BYTES
+from partitioning import KeyedMessage, message_key, message_headers, get_partitioner
+
+# تنظیمات پیش‌فرض تولیدکننده کافکا؛ با set_producer_options قابل تغییر است
+DEFAULT_PRODUCER_OPTIONS = {
+    "linger_ms": 20,
+    "max_batch_size": 512 * 1024,
+    "acks": 1,
+    "compression_type": None,  # "gzip", "snappy", "lz4" یا "zstd"
+}
+DEFAULT_MAX_IN_FLIGHT = 64
+# حداکثر تعداد batch های آماده در صف بین thread تولیدکننده و حلقه asyncio
+DEFAULT_MAX_PENDING_BATCHES = 8
+# هر چند ثانیه پیام‌های spool شده دوباره ارسال شوند و در هر مرحله چند پیام
+SPOOL_REPLAY_INTERVAL = 10
+SPOOL_REPLAY_BATCH = 500
+# تنظیمات نشست HTTP مشترک با DB handler
+HTTP_POOL_SIZE = 8
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_TIMEOUT = 30
+# خطاهای ارسالی که با تلاش دوباره برطرف نمی‌شوند و نباید spool شوند (نام کلاس‌ها، تا aiokafka دیر بارگذاری شود)
+NON_RETRIABLE_ERRORS = frozenset({
+    "MessageSizeTooLargeError", "RecordTooLargeError", "InvalidTopicError", "TopicAuthorizationFailedError",
+    "UnsupportedVersionError", "TypeError", "ValueError",
+})
+# فاصله انتشار خلاصه متریک‌ها روی topic (در صورت فعال بودن)
+METRICS_PUBLISH_INTERVAL = 15
+# تعداد تیک در هر پیام خروجی تاریخچه تیک
+TICK_EXPORT_CHUNK_ROWS = 50000
+
+
+class DeliveryReport:
+    """Delivery outcome of a group of messages published to one topic."""
+
+    def __init__(self, topic, results=(), elapsed=0.0, spooled=0):
+        self.topic = topic
+        self.sent = len(results)
+        self.errors = [(index, error) for index, error in enumerate(results) if error is not None]
+        # پیام‌های spool شده خطا حساب نمی‌شوند چون پس از وصل شدن دوباره ارسال می‌شوند
+        self.spooled = spooled
+        self.delivered = self.sent - len(self.errors) - spooled
+        self.elapsed = elapsed
+        # تعداد پیام‌های پشت‌سرهم موفق (یا spool شده) از ابتدا؛ برای جلو بردن امن watermark
+        self.delivered_prefix = self.errors[0][0] if self.errors else self.sent
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @classmethod
+    def combine(cls, topic, reports):
+        """Merges the reports of several publish runs into one summary."""
+        combined = cls(topic)
+        for report in reports:
+            combined.errors.extend((combined.sent + index, error) for index, error in report.errors)
+            combined.sent += report.sent
+            combined.delivered += report.delivered
+            combined.spooled += report.spooled
+            combined.elapsed += report.elapsed
+        combined.delivered_prefix = combined.errors[0][0] if combined.errors else combined.sent
+        return combined
+
+    def __repr__(self):
+        return (f"DeliveryReport(topic={self.topic!r}, sent={self.sent}, delivered={self.delivered}, "
+                f"spooled={self.spooled}, failed={len(self.errors)}, elapsed={self.elapsed:.3f}s)")
+
+
+class KafkaPublisher:
+    """
+    Keeps up to `max_in_flight` sends outstanding per topic instead of waiting for
+    each broker round-trip, and collects the delivery futures in bulk.
+    Must be used from the background event loop.
+    """
+
+    def __init__(self, producer, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.producer = producer
+        self.max_in_flight = max_in_flight
+        self._windows = {}
+        self._in_flight = {}
+
+    def _window(self, topic):
+        window = self._windows.get(topic)
+        if window is None:
+            window = self._windows[topic] = asyncio.Semaphore(self.max_in_flight)
+        return window
+
+    def in_flight(self, topic=None):
+        if topic is None:
+            return sum(self._in_flight.values())
+        return self._in_flight.get(topic, 0)
+
+    def _release(self, topic, window):
+        self._in_flight[topic] -= 1
+        window.release()
+
+    async def send(self, topic, value, key=None, headers=None, on_ack=None):
+        """
+        Waits for a free slot in the topic's window, hands the message to the producer
+        and returns its delivery future without waiting for the broker ack. `on_ack(latency)`
+        is called on a successful delivery with the seconds since the hand-over, so time spent
+        queued or waiting for the window is not counted.
+        """
+        window = self._window(topic)
+        started = time.perf_counter() if METRICS.enabled else None
+        await window.acquire()
+        self._in_flight[topic] = self._in_flight.get(topic, 0) + 1
+        try:
+            sent = time.perf_counter()
+            delivery = await self.producer.send(topic, value, key=key, headers=headers)
+        except Exception:
+            self._release(topic, window)
+            raise
+        if on_ack is not None:
+            def acked(future):
+                if not future.cancelled() and future.exception() is None:
+                    on_ack(time.perf_counter() - sent)
+            delivery.add_done_callback(acked)
+        if started is not None:
+            METRICS.observe("agent_kafka_send_wait_seconds", sent - started, topic=topic)
+            METRICS.inc("agent_encoded_bytes_total", len(value), topic=topic)
+            delivery.add_done_callback(
+                lambda _: METRICS.observe("agent_kafka_ack_seconds", time.perf_counter() - sent, topic=topic))
+        delivery.add_done_callback(lambda _: self._release(topic, window))
+        return delivery
 
 
 class AgentClient:
-    def __init__(self, gui_callback_queue, mt5_manager):
+    def __init__(self, gui_callback_queue, mt5_manager, sync_workers=DEFAULT_SYNC_WORKERS):
         self.logger = setup_logger()
         self.gui_callback_queue = gui_callback_queue
         self.mt5 = mt5_manager
         self.kafka_servers = None
         self.db_handler_url = None  # برای درخواست HTTP
         self.producer = None
+        self.publisher = None
+        self.producer_options = dict(DEFAULT_PRODUCER_OPTIONS)
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        self.max_pending_batches = DEFAULT_MAX_PENDING_BATCHES
+        self.rates_codec = get_codec("json")
+        self.batch_target_bytes = DEFAULT_TARGET_BYTES
+        self.partitioner = "default"
+        # True: هر نماد کاتالوگ یک پیام جدا با کلید login|symbol (مناسب topic های compact شده)
+        self.per_symbol_catalogue = False
+        self.max_message_bytes = DEFAULT_MAX_MESSAGE_BYTES
         self.running = False
         self.lock = threading.Lock()
         self.login_number = None
         self.background_loop = None
+        self.client_thread = None
+        self.tick_streamer = None
+        self.state_publisher = None
+        self.refresh_scheduler = None
+        self.connections = ConnectionSupervisor(self)
+        self.watermarks = WatermarkStore()
+        # نقطه ادامه خروجی تاریخچه تیک؛ همان ساختار watermark با تایم‌فریم صفر و زمان میلی‌ثانیه
+        self.tick_checkpoints = WatermarkStore(TICK_CHECKPOINT_FILE)
+        self.spool = MessageSpool()
+        self.symbol_catalog = SymbolCatalogState()
+        self.http_cache = ConditionalCache()
+        self.http_session = None
+        self.metrics_server = None
+        self.metrics_topic = None
+        self.metrics_interval = METRICS_PUBLISH_INTERVAL
+        self._handoffs = set()
+        self.sync_scheduler = SyncScheduler(self, workers=sync_workers)
 
     def set_server_address(self, kafka_servers, db_handler_url):
         self.kafka_servers = kafka_servers
@@ -33,111 +196,788 @@ class AgentClient:
         self.log_and_gui(f"Kafka servers set to {self.kafka_servers}")
         self.log_and_gui(f"DB Handler URL set to {self.db_handler_url}")
 
+    def set_producer_options(self, max_in_flight=None, **options):
+        """
+        Tunes the Kafka producer (linger_ms, max_batch_size, acks, compression_type, ...)
+        and the per-topic in-flight window. Takes effect on the next connect.
+        """
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        self.producer_options.update(options)
+
+    def set_partitioning(self, partitioner=None, per_symbol_catalogue=None):
+        """
+        Selects the producer partitioner by name ("default" hashes the whole key, "symbol" keeps all
+        timeframes of a symbol on one partition) and whether catalogue entries are sent one keyed
+        message per symbol instead of batches keyed by login. Takes effect on the next connect.
+        """
+        if partitioner is not None:
+            instance = get_partitioner(partitioner)
+            self.partitioner = partitioner
+            if instance is None:
+                self.producer_options.pop("partitioner", None)
+            else:
+                self.producer_options["partitioner"] = instance
+        if per_symbol_catalogue is not None:
+            self.per_symbol_catalogue = per_symbol_catalogue
+
+    def set_batch_budget(self, target_bytes=None, max_message_bytes=None):
+        """
+        Sets the encoded size each symbols/rates message should aim for and the hard limit above
+        which a batch is split (keep it below the producer's max_request_size).
+        """
+        if target_bytes is not None:
+            self.batch_target_bytes = target_bytes
+        if max_message_bytes is not None:
+            self.max_message_bytes = max_message_bytes
+
+    def new_batcher(self, initial_rows, **options):
+        """Returns an AdaptiveBatcher using the client's byte budget; starts at `initial_rows` per batch."""
+        return AdaptiveBatcher(initial_rows, self.batch_target_bytes, self.max_message_bytes, **options)
+
+    def set_wire_format(self, name):
+        """Selects the rates batch encoding: "json" (compatibility) or "columnar"."""
+        self.rates_codec = get_codec(name)
+        self.log_and_gui(f"Rates wire format set to {name}")
+
+    def enable_metrics(self, port=DEFAULT_METRICS_PORT, host="127.0.0.1", topic=None,
+                       interval=METRICS_PUBLISH_INTERVAL):
+        """
+        Turns on per-stage instrumentation (MT5 call latency, transform/encode time, send wait,
+        ack latency, in-flight and queue depths) and serves it at http://<host>:<port>/metrics.
+        Pass port=None to skip the endpoint; with `topic` set, a snapshot is also published
+        to that Kafka topic every `interval` seconds.
+        """
+        METRICS.enabled = True
+        METRICS.gauge_function("agent_kafka_in_flight", lambda: self.publisher.in_flight() if self.publisher else 0)
+        METRICS.gauge_function("agent_handoff_queue_depth", lambda: sum(q.qsize() for q in list(self._handoffs)))
+        METRICS.gauge_function("agent_spool_pending", self.spool.pending_count)
+        METRICS.gauge_function("agent_sync_jobs_active", self.sync_scheduler.active_count)
+        self.metrics_topic = topic
+        self.metrics_interval = interval
+        if port is not None and self.metrics_server is None:
+            self.metrics_server = MetricsServer(METRICS, host, port)
+            self.metrics_server.start()
+
+    async def _publish_metrics(self):
+        snapshot = METRICS.snapshot()
+        snapshot.update({"type": "agent_metrics", "login": self.login_number, "time": int(time.time())})
+        try:
+            delivery = await self.publisher.send(self.metrics_topic, self._encode(snapshot),
+                                                 message_key(self.login_number), message_headers("agent_metrics"))
+            await delivery
+        except Exception as e:
+            # متریک‌ها spool نمی‌شوند؛ از دست رفتن یک snapshot اهمیتی ندارد
+            self.logger.debug(f"Could not publish metrics snapshot: {e}")
+
     def log_and_gui(self, message, level="info"):
         self.gui_callback_queue.put({"type": "log", "level": level, "message": message})
 
     def start(self):
         if self.running: return
         self.running = True
-        threading.Thread(target=self._run_client, daemon=True).start()
-        # Scheduler is no longer needed here as sync is manual
-        # threading.Thread(target=self._run_scheduler, daemon=True).start()
+        self.client_thread = threading.Thread(target=self._run_client, daemon=True)
+        self.client_thread.start()
 
     def _run_client(self):
         self.background_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.background_loop)
         self.background_loop.run_until_complete(self._connect_and_run())
+        self.background_loop.close()
+
+    def create_producer(self):
+        """Builds a (not yet started) Kafka producer with the current options."""
+        # aiokafka فقط هنگام اتصال بارگذاری می‌شود تا شروع برنامه سریع‌تر باشد
+        from aiokafka import AIOKafkaProducer
+        return AIOKafkaProducer(bootstrap_servers=self.kafka_servers, **self.producer_options)
+
+    def attach_producer(self, producer):
+        self.producer = producer
+        self.publisher = KafkaPublisher(producer, self.max_in_flight)
+        self.log_and_gui("Kafka Producer Status: Connected", "info")
 
     async def _connect_and_run(self):
         try:
-            self.producer = AIOKafkaProducer(bootstrap_servers=self.kafka_servers)
-            await self.producer.start()
-            self.log_and_gui("Kafka Producer Status: Connected", "info")
-
-            if self.mt5.connect():
-                account_info = self.mt5.get_account_info()
+            # اتصال کافکا و متاتریدر تا موفق شدن (یا توقف کلاینت) با تاخیر نمایی تکرار می‌شود
+            if not await self.connections.connect_kafka():
+                return
+            if await self.connections.wait_for_mt5():
+                account_info = await asyncio.get_running_loop().run_in_executor(None, self.mt5.get_account_info)
                 if account_info:
                     self.login_number = account_info['login']
                     # Send initial account info
                     await self._send_to_kafka(
                         "account_info",
-                        {"type": "account_info", "login": self.login_number, "data": account_info}
+                        {"type": "account_info", "login": self.login_number, "data": account_info},
+                        message_key(self.login_number), message_headers("account_info", "json")
                     )
+                    await self._request_db_watermarks_async()
                     # Notify GUI that client is ready
                     self.gui_callback_queue.put({"type": "client_ready", "login": self.login_number})
 
             # Keep the asyncio loop running in the background
+            last_replay = float("-inf")
+            last_metrics = time.monotonic()
+            loop_backoff = Backoff(initial=1.0, maximum=60.0)
             while self.running:
                 await asyncio.sleep(1)
+                # خطای یک دور (مثلاً خواندن spool یا پایش اتصال) ایجنت را خاموش نمی‌کند؛ با تاخیر دوباره امتحان می‌شود
+                try:
+                    if time.monotonic() - last_replay >= SPOOL_REPLAY_INTERVAL:
+                        last_replay = time.monotonic()
+                        await self._replay_spool()
+                    if self.metrics_topic and time.monotonic() - last_metrics >= self.metrics_interval:
+                        last_metrics = time.monotonic()
+                        await self._publish_metrics()
+                    await self.connections.check()
+                    loop_backoff.reset()
+                except Exception as e:
+                    delay = loop_backoff.next_delay()
+                    self.logger.error(f"Agent loop iteration failed, retrying in {delay:.1f}s: {e}", exc_info=True)
+                    await self.connections.pause(delay)
 
         except Exception as e:
-            self.log_and_gui(f"Kafka connection error: {e}", "error")
+            self.log_and_gui(f"Agent loop error: {e}", "error")
         finally:
             self.stop()
+            # task های پس‌زمینه باقی‌مانده (مثلاً زمان‌بند به‌روزرسانی در حال خواب) پیش از بسته شدن حلقه لغو می‌شوند
+            others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in others:
+                task.cancel()
+            await asyncio.gather(*others, return_exceptions=True)
+            # تولیدکننده همین‌جا و روی حلقه خودش بسته می‌شود تا حلقه به‌صورت طبیعی تمام شود
+            if self.producer:
+                try:
+                    await self.producer.stop()
+                except Exception as e:
+                    self.logger.warning(f"Error while stopping Kafka producer: {e}")
+                self.producer = None
+                self.publisher = None
+            if self.http_session is not None:
+                await self.http_session.close()
+                self.http_session = None
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+                self.metrics_server = None
 
-    def send_message(self, topic, message):
-        """Schedules a message to be sent to a Kafka topic."""
+    def send_message(self, topic, message, key=None, headers=None, spool=True):
+        """
+        Schedules a message to be sent to a Kafka topic.
+        Returns a concurrent future resolving to True on delivery, or None if the client is not running.
+        With spool=False (live data that is useless when replayed late) a failed send is not
+        written to the spool and the future resolves to False.
+        """
         if self.running and self.background_loop:
-            asyncio.run_coroutine_threadsafe(self._send_to_kafka(topic, message), self.background_loop)
+            return asyncio.run_coroutine_threadsafe(self._send_to_kafka(topic, message, key, headers, spool),
+                                                    self.background_loop)
+        return None
 
-    async def _send_to_kafka(self, topic, message):
-        """Sends a single message to a Kafka topic."""
-        if not self.producer:
-            self.log_and_gui("Cannot send message, Kafka producer is not running.", "error")
-            return
+    async def _send_to_kafka(self, topic, message, key=None, headers=None, spool=True):
+        """Sends a single message (a dict, or bytes already encoded by a codec) to a Kafka topic."""
+        value = message if isinstance(message, bytes) else self._encode(message)
+        if not self.publisher:
+            error = ConnectionError("Kafka producer is not running")
+        else:
+            try:
+                delivery = await self.publisher.send(topic, value, key, headers)
+                await delivery
+                return True
+            except Exception as e:
+                error = e
+        if not spool:
+            self.logger.warning(f"Kafka send to topic '{topic}' failed, message not spooled: {error}")
+            return False
+        self.log_and_gui(f"Kafka send error to topic '{topic}': {error}", "error")
+        return self._spool_message(topic, value, error, key, headers)
+
+    @staticmethod
+    def _retriable(error):
+        """False for send errors a later retry cannot fix (e.g. a message above max_request_size)."""
+        names = {cls.__name__ for cls in type(error).__mro__}
+        return not (names & NON_RETRIABLE_ERRORS)
+
+    def _spool_message(self, topic, value, error, key=None, headers=None):
+        """Writes an undeliverable message to the on-disk spool; returns True if it is now durable."""
+        if not self._retriable(error):
+            self.logger.error(f"Dropping message for topic '{topic}': {error!r} cannot succeed on retry.")
+            METRICS.inc("agent_messages_dropped_total", topic=topic)
+            return False
         try:
-            message_bytes = json.dumps(message).encode('utf-8')
-            await self.producer.send_and_wait(topic, message_bytes)
+            self.spool.append(topic, value, key, headers)
+            METRICS.inc("agent_messages_spooled_total", topic=topic)
+            return True
         except Exception as e:
-            self.log_and_gui(f"Kafka send error to topic '{topic}': {e}", "error")
+            self.logger.error(f"Could not spool message for topic '{topic}' after send error ({error}): {e}")
+            return False
+
+    async def _replay_spool(self):
+        """
+        Re-publishes spooled messages in order, a batch at a time, acknowledging (and compacting)
+        the spool after each fully delivered batch. Stops at the first failure; the rest is
+        retried on the next pass.
+        """
+        loop = asyncio.get_running_loop()
+        replayed = 0
+        while self.running and self.publisher and self.spool.pending_count():
+            records = await loop.run_in_executor(None, self.spool.read_pending, SPOOL_REPLAY_BATCH)
+            if not records:
+                break
+            try:
+                deliveries = [await self.publisher.send(topic, value, key, headers)
+                              for _, topic, key, value, headers in records]
+            except Exception as e:
+                self.logger.warning(f"Spool replay paused: {e}")
+                break
+            results = await asyncio.gather(*deliveries, return_exceptions=True)
+            delivered = 0
+            for result in results:
+                if isinstance(result, BaseException):
+                    if self._retriable(result):
+                        break
+                    # رکوردی که هرگز ارسال نمی‌شود نباید پیام‌های بعدی spool را برای همیشه متوقف کند
+                    self.logger.error(f"Discarding spooled message that cannot be delivered: {result!r}")
+                    METRICS.inc("agent_messages_dropped_total", topic=records[delivered][1])
+                delivered += 1
+            if delivered:
+                await loop.run_in_executor(None, self.spool.ack, records[delivered - 1][0])
+                replayed += delivered
+            if delivered < len(records):
+                self.logger.warning(f"Spool replay paused after {replayed} messages: {results[delivered]}")
+                break
+        if replayed:
+            self.log_and_gui(f"Replayed {replayed} spooled messages to Kafka.", "info")
+
+    @staticmethod
+    def _encode(message):
+        return json.dumps(message).encode('utf-8')
+
+    async def _drain_handoff(self, topic, handoff, on_delivery, failed=None):
+        """
+        Consumes encoded messages from the hand-off queue and keeps them in flight through
+        the publisher. Returns a DeliveryReport once the end marker (None) is reached and
+        every outstanding message has been acked or has failed. `failed` (a threading.Event)
+        is set as soon as a message can be neither delivered nor spooled.
+        """
+        started = time.monotonic()
+        results = []
+        spooled = [0]
+        outstanding = set()
+        latencies = {}  # تاخیر ack هر پیام که publisher از لحظه تحویل به producer اندازه گرفته است
+
+        def on_done(index, message, delivery):
+            outstanding.discard(delivery)
+            error = asyncio.CancelledError() if delivery.cancelled() else delivery.exception()
+            if error is not None and self._spool_message(topic, message.value, error, message.key, message.headers):
+                spooled[0] += 1
+                results[index] = None
+            else:
+                results[index] = error
+                if error is not None and failed is not None:
+                    failed.set()
+            if on_delivery:
+                on_delivery(index, error, latencies.pop(index, None))
+
+        while True:
+            message = await handoff.get()
+            if message is None:
+                break
+            index = len(results)
+            results.append(None)
+            try:
+                if not self.publisher:
+                    raise ConnectionError("Kafka producer is not running")
+                delivery = await self.publisher.send(topic, *message, on_ack=partial(latencies.__setitem__, index))
+            except Exception as e:
+                delivery = self.background_loop.create_future()
+                delivery.set_exception(e)
+            outstanding.add(delivery)
+            delivery.add_done_callback(partial(on_done, index, message))
+
+        if outstanding:
+            await asyncio.gather(*outstanding, return_exceptions=True)
+        return DeliveryReport(topic, results, time.monotonic() - started, spooled[0])
+
+    def _wait_threadsafe(self, coro):
+        """
+        Runs a coroutine on the background loop and blocks the calling thread until it finishes.
+        Raises ConnectionError if the client is stopped meanwhile, so worker threads never hang.
+        """
+        return self._wait_future(asyncio.run_coroutine_threadsafe(coro, self.background_loop))
+
+    def _wait_future(self, future):
+        """Waits for a concurrent future from the background loop; ConnectionError if the client stops first."""
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                if not self.running:
+                    future.cancel()
+                    raise ConnectionError("client stopped")
+
+    def publish_batches(self, topic, messages, on_delivery=None, stop_on_failure=False):
+        """
+        Publishes an iterable of messages (dicts, bytes already encoded by a codec, or KeyedMessage
+        values carrying a key and headers) from a worker thread. Encoded messages pass through a
+        bounded hand-off queue of `max_pending_batches`; when it is full the calling thread (and
+        therefore the MT5 batch generator) blocks, so memory stays flat however slow the broker is.
+        `on_delivery(index, error, latency)` is called per message as acks arrive (error is None on
+        success; latency is the broker ack time in seconds, None for failed messages).
+        With `stop_on_failure`, no further message is taken from `messages` once one could be
+        neither delivered nor spooled. Returns a DeliveryReport.
+        """
+        if not (self.running and self.background_loop):
+            return DeliveryReport(topic)
+
+        handoff = asyncio.Queue(maxsize=self.max_pending_batches)
+        self._handoffs.add(handoff)
+        failed = threading.Event() if stop_on_failure else None
+        drain = asyncio.run_coroutine_threadsafe(
+            self._drain_handoff(topic, handoff, on_delivery, failed), self.background_loop)
+        try:
+            for message in messages:
+                if failed is not None and failed.is_set():
+                    break
+                if isinstance(message, bytes):
+                    message = KeyedMessage(message)
+                elif not isinstance(message, KeyedMessage):
+                    with METRICS.timer("agent_encode_seconds", topic=topic):
+                        message = KeyedMessage(self._encode(message))
+                self._wait_threadsafe(handoff.put(message))
+            self._wait_threadsafe(handoff.put(None))
+            report = self._wait_future(drain)
+        except ConnectionError as e:
+            self.log_and_gui(f"Publishing to topic '{topic}' aborted: {e}", "error")
+            return DeliveryReport(topic, [e])
+        finally:
+            # هر خروج دیگری (مثلاً خطای generator یا encode) هم نباید task تخلیه را منتظر صف رها کند
+            if not drain.done():
+                drain.cancel()
+            self._handoffs.discard(handoff)
+
+        METRICS.inc("agent_messages_delivered_total", report.delivered, topic=topic)
+        METRICS.inc("agent_messages_failed_total", len(report.errors), topic=topic)
+
+        for index, error in report.errors[:3]:
+            self.log_and_gui(f"Kafka send error to topic '{topic}' (batch {index}): {error}", "error")
+        return report
+
+    @staticmethod
+    def _ack_counter(row_counts, ack_callback):
+        """Builds an on_delivery callback that reports the running number of acknowledged rows."""
+        acked = [0]
+
+        def on_delivery(index, error, latency=None):
+            if error is None:
+                acked[0] += row_counts[index]
+                ack_callback(acked[0])
+        return on_delivery
 
     def stop(self):
         with self.lock:
             if not self.running: return
             self.running = False
-            if self.producer:
-                asyncio.run_coroutine_threadsafe(self.producer.stop(), self.background_loop)
-            if self.background_loop:
-                self.background_loop.call_soon_threadsafe(self.background_loop.stop)
+            self.sync_scheduler.cancel()
+            if self.refresh_scheduler:
+                self.refresh_scheduler.stop()
+            if self.tick_streamer:
+                self.tick_streamer.stop_event.set()
+            if self.state_publisher:
+                self.state_publisher.stop_event.set()
             self.mt5.disconnect()
             self.log_and_gui("Client stopped", "info")
 
+    def wait_closed(self, timeout=10):
+        """Blocks until the background loop has flushed and closed the producer after stop()."""
+        if self.client_thread:
+            self.client_thread.join(timeout)
+
+    async def _get_http_session(self):
+        """Returns the client's pooled keep-alive HTTP session, creating it on first use."""
+        import aiohttp
+        if self.http_session is None or self.http_session.closed:
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+        return self.http_session
+
+    def cached_db_symbols(self):
+        """Symbol list from the last successful DB request (any account), for showing before connecting."""
+        return self.http_cache.latest(f"{self.db_handler_url or ''}/get_symbols/")
+
     async def _request_db_symbols_async(self):
-        """Fetches the initial symbol list via HTTP."""
+        """
+        Fetches the symbol list via HTTP and posts it to the GUI once the request has resolved. The
+        refresh is a conditional GET, so an unchanged list costs a single 304 response and the cached
+        copy is used; the cache is also the fallback when the DB handler is unreachable.
+        """
         if not self.login_number:
             self.log_and_gui("Cannot fetch symbols: Login number is unknown.", "error")
             return
 
         url = f"{self.db_handler_url}/get_symbols/{self.login_number}"
+        cached = self.http_cache.get(url)
+        symbols = cached or []
         self.log_and_gui(f"Requesting symbol list from {url}...", "info")
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self.logger.info(f"Received {len(data)} symbols from DB.")
-                        self.gui_callback_queue.put({"type": "db_symbols_list", "data": data})
-                    else:
-                        self.log_and_gui(f"Error fetching symbols: HTTP {response.status}", "error")
-                        self.gui_callback_queue.put({"type": "db_symbols_list", "data": []})
+            session = await self._get_http_session()
+            async with session.get(url, headers=self.http_cache.conditional_headers(url)) as response:
+                if response.status == 304 and cached is not None:
+                    self.logger.info("Symbol list unchanged on DB (HTTP 304), using cached copy.")
+                elif response.status == 200:
+                    symbols = await response.json()
+                    self.logger.info(f"Received {len(symbols)} symbols from DB.")
+                    self.http_cache.store(url, symbols, response.headers.get("ETag"),
+                                          response.headers.get("Last-Modified"), time.time())
+                else:
+                    self.log_and_gui(f"Error fetching symbols: HTTP {response.status}", "error")
         except Exception as e:
             self.log_and_gui(f"HTTP connection error: {e}", "error")
-            self.gui_callback_queue.put({"type": "db_symbols_list", "data": []})
+        self.gui_callback_queue.put({"type": "db_symbols_list", "data": symbols})
+
+    async def _request_db_watermarks_async(self):
+        """Seeds the local rates watermarks from the DB handler, if it exposes them."""
+        url = f"{self.db_handler_url}/get_rates_watermarks/{self.login_number}"
+        try:
+            session = await self._get_http_session()
+            async with session.get(url) as response:
+                if response.status == 200:
+                    entries = await response.json()
+                    self.watermarks.seed(self.login_number, entries)
+                    self.logger.info(f"Seeded {len(entries)} rates watermarks from DB.")
+                else:
+                    self.logger.info(f"DB handler did not provide watermarks (HTTP {response.status}), "
+                                     f"using local state.")
+        except Exception as e:
+            self.logger.warning(f"Could not fetch watermarks from DB handler: {e}")
+
+    def start_tick_stream(self, symbols, mode="latest", **options):
+        """
+        Starts publishing live ticks for `symbols` to the ticks topic (see TickStreamer for
+        the "latest" / "all" coalescing modes and buffering options). Replaces a running stream.
+        """
+        self.stop_tick_stream()
+        self.tick_streamer = TickStreamer(self, symbols, mode, **options)
+        self.tick_streamer.start()
+        return self.tick_streamer
+
+    def stop_tick_stream(self):
+        if self.tick_streamer:
+            self.tick_streamer.stop()
+            self.tick_streamer = None
+
+    def start_state_stream(self, **options):
+        """
+        Starts publishing account, position and order changes to the account_state topic (see
+        StatePublisher for the snapshot/delta messages and polling options). Replaces a running stream.
+        """
+        self.stop_state_stream()
+        self.state_publisher = StatePublisher(self, **options)
+        self.state_publisher.start()
+        return self.state_publisher
+
+    def stop_state_stream(self):
+        if self.state_publisher:
+            self.state_publisher.stop()
+            self.state_publisher = None
+
+    def start_refresh(self, symbols, timeframes=("M1",), **options):
+        """
+        Starts refreshing `symbols` right after every bar close of each timeframe in `timeframes`
+        (see RefreshScheduler for staggering, jitter and stale-symbol priority). Replaces a
+        running refresh; call after the client is ready.
+        """
+        self.stop_refresh()
+        self.refresh_scheduler = RefreshScheduler(self, symbols, timeframes, **options)
+        asyncio.run_coroutine_threadsafe(self.refresh_scheduler.run(), self.background_loop)
+        return self.refresh_scheduler
+
+    def stop_refresh(self):
+        if self.refresh_scheduler:
+            self.refresh_scheduler.stop()
+            self.refresh_scheduler = None
 
     def request_db_symbols(self):
         """Triggers the async request for the symbol list."""
         if self.running and self.background_loop:
             asyncio.run_coroutine_threadsafe(self._request_db_symbols_async(), self.background_loop)
 
-    def sync_symbols_in_batches(self, symbol_batches_generator):
-        """Sends symbol data in batches to Kafka."""
-        for batch in symbol_batches_generator:
-            payload = {"type": "symbols_info_sync", "login": self.login_number, "symbols": batch}
-            self.send_message("symbols_info_sync", payload)
-
-    def sync_rates_data_in_batches(self, symbol_name, rates_batches_generator):
-        """Sends historical rates data in batches to Kafka."""
-        for batch in rates_batches_generator:
-            payload = {"type": "sync_rates_data", "login": self.login_number, "symbol": symbol_name, "data": batch}
-            self.send_message("sync_rates_data", payload)
\ No newline at end of file
+    def sync_symbols_in_batches(self, symbol_batches_generator, ack_callback=None, mode="full", removed=(),
+                                batcher=None):
+        """
+        Sends symbol data in batches to Kafka and returns the DeliveryReport.
+        `ack_callback(acked_count)` reports how many symbols the broker has acknowledged so far.
+        In "delta" mode the batches hold only added/changed symbols and `removed` lists the
+        names of symbols that disappeared from the broker.
+        `batcher` (the AdaptiveBatcher also sizing the generator's batches) learns from each encoded
+        message and splits any batch above the message size limit.
+        Batches are keyed by login; with `per_symbol_catalogue` every symbol is its own message
+        keyed login|symbol, so a compacted topic keeps the latest entry per symbol.
+        """
+        batcher = batcher or self.new_batcher(500)
+        row_counts = []
+
+        def encode(rows):
+            return self._encode({"type": "symbols_info_sync", "login": self.login_number, "mode": mode, "symbols": rows})
+
+        def keyed(message_type, payload, rows, symbol=None):
+            row_counts.append(rows)
+            key = message_key(self.login_number, symbol) if symbol else message_key(self.login_number)
+            headers = message_headers(message_type, "json", len(row_counts) - 1, rows=rows, mode=mode)
+            return KeyedMessage(payload, key, headers)
+
+        def payloads():
+            for batch in symbol_batches_generator:
+                if not batch:
+                    continue
+                if self.per_symbol_catalogue:
+                    for record in batch:
+                        yield keyed("symbols_info_sync", encode([record]), 1, record['name'])
+                    continue
+                for rows, payload in batcher.encode(encode, batch):
+                    yield keyed("symbols_info_sync", payload, len(rows))
+            if self.per_symbol_catalogue:
+                for name in removed:
+                    yield keyed("symbols_info_removed", self._encode(
+                        {"type": "symbols_info_removed", "login": self.login_number, "symbols": [name]}), 1, name)
+            elif removed:
+                yield keyed("symbols_info_removed", self._encode(
+                    {"type": "symbols_info_removed", "login": self.login_number, "symbols": list(removed)}), len(removed))
+
+        on_delivery = self._ack_counter(row_counts, ack_callback) if ack_callback else None
+        on_delivery = batcher.ack_tracker(on_delivery)
+        return self.publish_batches("symbols_info_sync", payloads(), on_delivery)
+
+    def sync_symbol_catalog(self, progress_callback, ack_callback=None, full=False):
+        """
+        Publishes only the symbols added, changed or removed since the last delivered catalogue
+        (compared by content hash, ignoring bid/ask/time and other volatile fields). A full
+        catalogue is sent on first run, when `full` is set, or once FULL_RESYNC_INTERVAL has passed.
+        """
+        symbols_data = self.mt5.get_all_symbols()
+        if symbols_data is None:
+            return DeliveryReport("symbols_info_sync", [ConnectionError("could not read symbols from MT5")])
+
+        delta = self.symbol_catalog.diff(self.login_number, symbols_data, force_full=full)
+        self.log_and_gui(f"Symbol catalogue ({'full' if delta.full else 'delta'}): {len(delta.upserts)} to send, "
+                         f"{len(delta.removed)} removed, {len(symbols_data) - len(delta.upserts)} unchanged.")
+        if delta.empty:
+            progress_callback(0, 0)
+            return DeliveryReport("symbols_info_sync")
+
+        batcher = self.new_batcher(500)
+        batches = self.mt5.get_all_symbols_in_batches(progress_callback, batcher, symbols_data=delta.upserts)
+        report = self.sync_symbols_in_batches(batches, ack_callback, "full" if delta.full else "delta", delta.removed,
+                                              batcher)
+        if report.ok:
+            self.symbol_catalog.commit(self.login_number, delta)
+        return report
+
+    def sync_rates_data_in_batches(self, symbol_name, rates_batches_generator, timeframe=None, ack_callback=None,
+                                   cancel_event=None, topic="sync_rates_data", batcher=None):
+        """
+        Sends historical rates data in batches to Kafka and returns the DeliveryReport.
+        The watermark is advanced to the newest bar of the longest delivered prefix,
+        so a failed batch is re-sent on the next sync instead of being skipped.
+        `ack_callback(acked_rows)` reports how many rows the broker has acknowledged so far.
+        Setting `cancel_event` stops after the batches already handed over have been delivered.
+        `batcher` (the AdaptiveBatcher also sizing the generator's batches) learns from each encoded
+        message and splits any batch above the message size limit.
+        """
+        timeframe = self.mt5.default_timeframe if timeframe is None else timeframe
+        batcher = batcher or self.new_batcher(5000)
+        codec = self.rates_codec
+        meta = {"type": "sync_rates_data", "login": self.login_number, "symbol": symbol_name, "timeframe": timeframe}
+        row_counts = []
+        last_times = []
+
+        def encode(rows):
+            with METRICS.timer("agent_encode_seconds", topic=topic, codec=codec.name):
+                return codec.encode_rates(meta, rows)
+
+        key = message_key(self.login_number, symbol_name, timeframe)
+
+        def payloads():
+            for batch in rates_batches_generator:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if batch is None or len(batch) == 0:
+                    continue
+                for rows, payload in batcher.encode(encode, batch):
+                    headers = message_headers("sync_rates_data", codec.name, len(row_counts), rows=len(rows))
+                    row_counts.append(len(rows))
+                    last_times.append(int(rows[-1]['time']))
+                    yield KeyedMessage(payload, key, headers)
+
+        on_delivery = self._ack_counter(row_counts, ack_callback) if ack_callback else None
+        on_delivery = batcher.ack_tracker(on_delivery)
+        report = self.publish_batches(topic, payloads(), on_delivery)
+        if report.delivered_prefix:
+            self.watermarks.advance(self.login_number, symbol_name, timeframe,
+                                    last_times[report.delivered_prefix - 1])
+        return report
+
+    def sync_rates(self, symbol_name, progress_callback, timeframe=None, ack_callback=None, cancel_event=None):
+        """Incrementally syncs a symbol: only bars at or after the stored watermark are fetched and sent."""
+        timeframe = self.mt5.default_timeframe if timeframe is None else timeframe
+        since = self.watermarks.get(self.login_number, symbol_name, timeframe)
+        batcher = self.new_batcher(5000)
+        rates_generator = self.mt5.get_rates_in_batches(symbol_name, progress_callback, timeframe=timeframe,
+                                                        batch_size=batcher, since=since,
+                                                        raw=self.rates_codec.wants_raw)
+        return self.sync_rates_data_in_batches(symbol_name, rates_generator, timeframe, ack_callback, cancel_event,
+                                               batcher=batcher)
+
+    def sync_rates_multi(self, symbol_name, progress_callback, timeframes=DERIVED_TIMEFRAMES, ack_callback=None,
+                         cancel_event=None, topic_per_timeframe=False, verify=False, batch_size=5000):
+        """
+        Syncs several timeframes of a symbol from a single M1 fetch: higher timeframes are derived
+        by MT5Manager.get_multi_timeframe_rates. Each timeframe keeps its own watermark and is
+        published as batches tagged with its timeframe, on "sync_rates_data" or, with
+        `topic_per_timeframe`, on "sync_rates_data_<tf>" (e.g. sync_rates_data_h1).
+        """
+        constants = {name: self.mt5.timeframe_from_name(name) for name in timeframes}
+        marks = {name: self.watermarks.get(self.login_number, symbol_name, tf) for name, tf in constants.items()}
+        since = None if None in marks.values() else min(marks.values())
+        derived = self.mt5.get_multi_timeframe_rates(symbol_name, timeframes, since=since, verify=verify)
+        if derived is None:
+            return DeliveryReport("sync_rates_data", [ConnectionError(f"could not read M1 rates for {symbol_name}")])
+
+        for name, mark in marks.items():
+            if mark is not None:
+                derived[name] = derived[name][derived[name]['time'] >= mark]
+        total = sum(len(bars) for bars in derived.values())
+        if not total:
+            progress_callback(0, 0)
+
+        reports = []
+        offset = 0
+        for name, bars in derived.items():
+            if not len(bars):
+                continue
+            batcher = self.new_batcher(batch_size)
+            batches = self.mt5.iter_array_batches(bars, batcher, progress_callback, offset, total)
+            acked_before = offset
+            on_ack = (lambda acked, base=acked_before: ack_callback(base + acked)) if ack_callback else None
+            topic = f"sync_rates_data_{name.lower()}" if topic_per_timeframe else "sync_rates_data"
+            reports.append(self.sync_rates_data_in_batches(symbol_name, batches, constants[name], on_ack,
+                                                           cancel_event, topic, batcher))
+            offset += len(bars)
+        return DeliveryReport.combine("sync_rates_data", reports)
+
+    @staticmethod
+    def _tick_chunks(windows, chunk_rows, checkpoints):
+        """
+        Regroups the variable-size tick windows into arrays of exactly `chunk_rows` ticks (the last
+        one may be shorter); `chunk_rows` may be a callable such as an AdaptiveBatcher, asked before
+        every chunk. For every chunk the resume point after it is appended to `checkpoints`: the
+        time_msc of the first tick not yet emitted, or the end of the last window once everything
+        read is emitted. Resuming from it (time_msc >= point) never skips a tick; at most the ticks
+        of the chunk that share that millisecond are sent again.
+        """
+        pending = []
+        buffered = 0
+        emitted = 0
+        received = 0
+        window_ends = []  # (window end, ticks received up to and including that window)
+
+        def completed():
+            while len(window_ends) > 1 and window_ends[1][1] <= emitted:
+                window_ends.pop(0)
+            return window_ends[0][0] if window_ends and window_ends[0][1] <= emitted else None
+
+        def take(count):
+            nonlocal buffered, emitted
+            joined = pending[0] if len(pending) == 1 else np.concatenate(pending)
+            chunk, rest = joined[:count], joined[count:]
+            pending[:] = [rest] if len(rest) else []
+            buffered -= len(chunk)
+            emitted += len(chunk)
+            mark = completed()
+            if pending:
+                # تیک بعدی هنوز ارسال نشده؛ ادامه از میلی‌ثانیه همان تیک است تا تیک‌های هم‌زمان با مرز chunk جا نیفتند
+                mark = int(pending[0]['time_msc'][0])
+            checkpoints.append(mark)
+            return chunk
+
+        for window_end, ticks in windows:
+            if len(ticks):
+                pending.append(ticks)
+                buffered += len(ticks)
+                received += len(ticks)
+            window_ends.append((window_end, received))
+            size = max(1, int(chunk_rows() if callable(chunk_rows) else chunk_rows))
+            while buffered >= size:
+                yield take(size)
+                size = max(1, int(chunk_rows() if callable(chunk_rows) else chunk_rows))
+        if buffered:
+            yield take(buffered)
+
+    def export_tick_history(self, symbol_name, date_from, date_to, progress_callback=None, chunk_rows=TICK_EXPORT_CHUNK_ROWS,
+                            resume=True, cancel_event=None, topic="tick_history", **window_options):
+        """
+        Streams the raw tick history of [date_from, date_to) (datetimes) to Kafka as chunks of
+        `chunk_rows` ticks encoded with the rates codec. MT5Manager.iter_tick_history reads the range
+        in adaptive time windows and the bounded hand-off queue applies back-pressure, so memory stays
+        flat however long the range is. The export stops at the first chunk that can be neither
+        delivered nor spooled, and the checkpoint follows every delivered chunk, so with `resume`
+        a later run continues right after the last chunk delivered. Returns the DeliveryReport.
+        """
+        start_msc = int(date_from.timestamp() * 1000)
+        end_msc = int(date_to.timestamp() * 1000)
+        checkpoint = self.tick_checkpoints.get(self.login_number, symbol_name, 0) if resume else None
+        if checkpoint is not None and start_msc < checkpoint < end_msc:
+            self.log_and_gui(f"Resuming tick export of {symbol_name} from checkpoint {checkpoint}.")
+            start_msc = checkpoint
+        elif checkpoint is not None and checkpoint >= end_msc:
+            self.log_and_gui(f"Tick history of {symbol_name} is already exported up to the requested end.")
+            return DeliveryReport(topic)
+
+        codec = self.rates_codec
+        meta = {"type": "tick_history", "login": self.login_number, "symbol": symbol_name}
+        # تعداد تیک هر پیام از بودجه حجم پیام تعیین می‌شود و chunk_rows فقط سقف آن است
+        batcher = self.new_batcher(chunk_rows, max_rows=chunk_rows)
+        chunk_checkpoints = []
+        checkpoints = []  # به ازای هر پیام؛ فقط آخرین تکه یک chunk نقطه ادامه آن را دارد
+        state = {"exhausted": False, "failed": False}
+
+        def windows():
+            for window_end, ticks in self.mt5.iter_tick_history(symbol_name, start_msc, end_msc, **window_options):
+                if ticks is None:
+                    state["failed"] = True
+                    return
+                if progress_callback:
+                    progress_callback(window_end - start_msc, end_msc - start_msc)
+                yield window_end, ticks
+            state["exhausted"] = True
+
+        key = message_key(self.login_number, symbol_name)
+
+        def encode(rows):
+            with METRICS.timer("agent_encode_seconds", topic=topic, codec=codec.name):
+                return codec.encode_rates({**meta, "chunk": len(checkpoints)}, rows)
+
+        def payloads():
+            for chunk in self._tick_chunks(windows(), batcher, chunk_checkpoints):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                parts = batcher.encode(encode, chunk)
+                for index, (rows, payload) in enumerate(parts):
+                    headers = message_headers("tick_history", codec.name, len(checkpoints), rows=len(rows))
+                    checkpoints.append(chunk_checkpoints[-1] if index == len(parts) - 1 else None)
+                    yield KeyedMessage(payload, key, headers)
+
+        on_delivery = batcher.ack_tracker()
+        report = self.publish_batches(topic, payloads(), on_delivery, stop_on_failure=True)
+        delivered = [mark for mark in checkpoints[:report.delivered_prefix] if mark is not None]
+        if report.ok and state["exhausted"]:
+            delivered.append(end_msc)
+        if state["failed"]:
+            self.log_and_gui(f"Tick export of {symbol_name} stopped: could not read ticks from MT5.", "error")
+            report = DeliveryReport.combine(topic, [report, DeliveryReport(
+                topic, [ConnectionError(f"could not read ticks for {symbol_name}")])])
+        if delivered:
+            self.tick_checkpoints.advance(self.login_number, symbol_name, 0, delivered[-1])
+        return report
+
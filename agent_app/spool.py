@@ -0,0 +1,175 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/spool.py
+# Description: صف ماندگار روی دیسک (append-only و segment بندی‌شده) برای پیام‌های ارسال‌نشده کافکا.
+# ==================================================================
+import json
+import os
+import struct
+import threading
+import logging
+from config import SPOOL_DIR
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+SEGMENT_SUFFIX = ".seg"
+ACK_FILE = "acked.offset"
+
+
+class MessageSpool:
+    """
+    Append-only on-disk log of Kafka messages that could not be delivered.
+
+    Messages are written to numbered segment files (named after the first sequence number
+    they hold) as length-prefixed records. `ack(seq)` records that everything up to `seq`
+    reached the broker; segments that are fully acknowledged are deleted by `compact()`.
+    A torn record at the end of the last segment (crash mid-write) is truncated on open.
+    """
+    _RECORD = struct.Struct("<QHIII")  # seq, topic length, key length, headers length, value length
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.logger = logging.getLogger("AgentApp")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.acked = self._load_ack()
+        self._segments = self._list_segments()
+        self.next_seq = self._recover()
+        self._active = None
+
+    # ------------------------------------------------------------------ state on disk
+    def _segment_path(self, first_seq):
+        return os.path.join(self.directory, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        return [(int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, name)) for name in names]
+
+    def _load_ack(self):
+        try:
+            with open(os.path.join(self.directory, ACK_FILE), 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _save_ack(self):
+        path = os.path.join(self.directory, ACK_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(self.acked))
+        os.replace(path + '.tmp', path)
+
+    def _read_records(self, path):
+        """Yields (seq, topic, key, value, headers, end offset) for every complete record in a segment."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + self._RECORD.size <= len(data):
+            seq, topic_len, key_len, headers_len, value_len = self._RECORD.unpack_from(data, offset)
+            start = offset + self._RECORD.size
+            end = start + topic_len + key_len + headers_len + value_len
+            if end > len(data):
+                break
+            topic = data[start:start + topic_len].decode('utf-8')
+            start += topic_len
+            key = data[start:start + key_len] if key_len else None
+            start += key_len
+            headers = json.loads(data[start:start + headers_len]) if headers_len else None
+            start += headers_len
+            headers = [(name, value.encode('latin-1')) for name, value in headers] if headers else None
+            yield seq, topic, key, data[start:end], headers, end
+            offset = end
+
+    def _recover(self):
+        if not self._segments:
+            return self.acked + 1
+        last_seq, valid_end = self.acked, 0
+        path = self._segments[-1][1]
+        for seq, *_, end in self._read_records(path):
+            last_seq, valid_end = seq, end
+        if valid_end < os.path.getsize(path):
+            self.logger.warning(f"Truncating torn record at the end of spool segment {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+        return max(last_seq, self._segments[-1][0] - 1, self.acked) + 1
+
+    # ------------------------------------------------------------------ public API
+    def append(self, topic, value, key=None, headers=None):
+        """Appends one message and returns its sequence number."""
+        topic_bytes = topic.encode('utf-8')
+        key = key or b""
+        headers_bytes = json.dumps([(name, value.decode('latin-1')) for name, value in headers]).encode(
+            'utf-8') if headers else b""
+        with self.lock:
+            seq = self.next_seq
+            if self._active is None or self._active.tell() >= self.segment_bytes:
+                self._roll(seq)
+            self._active.write(self._RECORD.pack(seq, len(topic_bytes), len(key), len(headers_bytes), len(value)))
+            self._active.write(topic_bytes)
+            self._active.write(key)
+            self._active.write(headers_bytes)
+            self._active.write(value)
+            self._active.flush()
+            self.next_seq = seq + 1
+            return seq
+
+    def _roll(self, first_seq):
+        if self._active is not None:
+            os.fsync(self._active.fileno())
+            self._active.close()
+        path = self._segment_path(first_seq)
+        self._segments.append((first_seq, path))
+        self._active = open(path, 'ab')
+
+    def pending_count(self):
+        with self.lock:
+            return self.next_seq - 1 - self.acked
+
+    def read_pending(self, max_records=500):
+        """Returns up to `max_records` unacknowledged messages, oldest first, as (seq, topic, key, value, headers)."""
+        with self.lock:
+            if self._active is not None:
+                self._active.flush()
+            segments = list(self._segments)
+            acked = self.acked
+        records = []
+        for index, (first_seq, path) in enumerate(segments):
+            next_first = segments[index + 1][0] if index + 1 < len(segments) else None
+            if next_first is not None and next_first <= acked + 1:
+                continue
+            for seq, topic, key, value, headers, _ in self._read_records(path):
+                if seq <= acked:
+                    continue
+                records.append((seq, topic, key, value, headers))
+                if len(records) >= max_records:
+                    return records
+        return records
+
+    def ack(self, seq):
+        """Marks every message up to and including `seq` as delivered, then compacts."""
+        with self.lock:
+            if seq <= self.acked:
+                return
+            self.acked = seq
+            self._save_ack()
+        self.compact()
+
+    def compact(self):
+        """Deletes segments whose messages have all been acknowledged."""
+        with self.lock:
+            keep = []
+            for index, (first_seq, path) in enumerate(self._segments):
+                is_last = index + 1 == len(self._segments)
+                last_seq = self.next_seq - 1 if is_last else self._segments[index + 1][0] - 1
+                if last_seq > self.acked:
+                    keep.append((first_seq, path))
+                    continue
+                if is_last and self._active is not None:
+                    self._active.close()
+                    self._active = None
+                os.remove(path)
+            self._segments = keep
+
+    def close(self):
+        with self.lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
@@ -0,0 +1,166 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/state_stream.py
+# Description: پخش وضعیت حساب، پوزیشن‌ها و سفارش‌ها به کافکا فقط به صورت تغییرات، با snapshot کامل دوره‌ای.
+# ==================================================================
+import threading
+import time
+from collections import deque
+from logger import setup_logger
+from partitioning import message_key, message_headers
+
+STATE_TOPIC = "account_state"
+DEFAULT_POLL_INTERVAL_MS = 500
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+DEFAULT_MAX_PENDING = 4
+
+
+def diff_fields(old, new):
+    """Fields of namedtuple `new` whose values differ from `old` (same type), as a dict."""
+    return {name: value for name, before, value in zip(new._fields, old, new) if before != value}
+
+
+def diff_tickets(previous, rows):
+    """
+    Compares positions or orders keyed by ticket. Returns (current, changes): `current` is the new
+    {ticket: row} table and `changes` holds "opened" rows, "closed" tickets and the changed fields
+    of "modified" tickets; empty parts are left out. Unchanged rows cost one tuple comparison.
+    """
+    current = {row.ticket: row for row in rows}
+    opened, modified = [], []
+    for ticket, row in current.items():
+        old = previous.get(ticket)
+        if old is None:
+            opened.append(row._asdict())
+        elif old != row:
+            modified.append({"ticket": ticket, **diff_fields(old, row)})
+    closed = [ticket for ticket in previous if ticket not in current]
+    changes = {}
+    if opened:
+        changes["opened"] = opened
+    if closed:
+        changes["closed"] = closed
+    if modified:
+        changes["modified"] = modified
+    return current, changes
+
+
+class StatePublisher:
+    """
+    Polls account_info, positions_get and orders_get every `poll_interval_ms` and publishes what
+    changed since the last published state to the account_state topic:
+
+    state_snapshot: the full account, positions and orders; sent at start, every
+                    `snapshot_interval` seconds and after any failed delivery, so late consumers
+                    and consumers that lost a delta can rebuild the state. State messages are
+                    never spooled, so a stale delta is never replayed after newer state.
+    state_delta:    changed account fields, and opened/closed/modified positions and orders.
+                    Polls without changes send nothing.
+
+    Every message carries a `seq` and deltas carry the `base_seq` they apply to; a consumer that
+    sees a gap waits for the next snapshot. While Kafka lags (`max_pending` messages in flight)
+    polls keep diffing against the last published state, so the next delta covers them all.
+    """
+
+    def __init__(self, client, poll_interval_ms=DEFAULT_POLL_INTERVAL_MS, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING, topic=STATE_TOPIC):
+        self.logger = setup_logger()
+        self.client = client
+        self.mt5 = client.mt5
+        self.poll_interval = poll_interval_ms / 1000
+        self.snapshot_interval = snapshot_interval
+        self.max_pending = max_pending
+        self.topic = topic
+        self.stop_event = threading.Event()
+        self.thread = None
+        self._account = None
+        self._positions = {}
+        self._orders = {}
+        self._sequence = 0
+        self._next_snapshot = 0.0
+        self._pending = deque()
+        self.snapshots = 0
+        self.deltas = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self._next_snapshot = 0.0
+        self.thread = threading.Thread(target=self._run, name="StatePublisher", daemon=True)
+        self.thread.start()
+        self.client.log_and_gui(f"Account state stream started (every {self.poll_interval * 1000:.0f} ms).")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.client.log_and_gui(f"Account state stream stopped: {self.snapshots} snapshots, {self.deltas} deltas.")
+
+    def _check_pending(self):
+        """Drops finished sends; returns False if Kafka is lagging. A lost message forces a snapshot."""
+        while self._pending and self._pending[0].done():
+            future = self._pending.popleft()
+            if future.cancelled() or future.exception() is not None or future.result() is not True:
+                self._next_snapshot = 0.0
+        return len(self._pending) < self.max_pending
+
+    def _publish(self, message_type, payload):
+        base_seq = self._sequence
+        self._sequence += 1
+        message = {"type": message_type, "login": self.client.login_number, "seq": self._sequence,
+                   "time_msc": int(time.time() * 1000), **payload}
+        if message_type == "state_delta":
+            message["base_seq"] = base_seq
+        # پیام وضعیت spool نمی‌شود: delta ی که دیر و خارج از ترتیب برسد وضعیت مصرف‌کننده را خراب می‌کند
+        future = self.client.send_message(self.topic, message, message_key(self.client.login_number),
+                                          message_headers(message_type, "json", sequence=self._sequence),
+                                          spool=False)
+        if future is None:
+            self._next_snapshot = 0.0
+        else:
+            self._pending.append(future)
+
+    def _poll(self):
+        if self.client.login_number is None or not self._check_pending():
+            return
+        state = self.mt5.get_trading_state()
+        if state is None:
+            return
+        account, positions, orders = state
+
+        if time.monotonic() >= self._next_snapshot:
+            self._account = account
+            self._positions = {row.ticket: row for row in positions}
+            self._orders = {row.ticket: row for row in orders}
+            self._next_snapshot = time.monotonic() + self.snapshot_interval
+            self._publish("state_snapshot", {
+                "account": account._asdict(),
+                "positions": [row._asdict() for row in positions],
+                "orders": [row._asdict() for row in orders],
+            })
+            self.snapshots += 1
+            return
+
+        delta = {}
+        if account != self._account:
+            delta["account"] = diff_fields(self._account, account)
+        current_positions, changes = diff_tickets(self._positions, positions)
+        if changes:
+            delta["positions"] = changes
+        current_orders, changes = diff_tickets(self._orders, orders)
+        if changes:
+            delta["orders"] = changes
+        if not delta:
+            return
+        self._account, self._positions, self._orders = account, current_positions, current_orders
+        self._publish("state_delta", delta)
+        self.deltas += 1
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self._poll()
+            except Exception as e:
+                self.logger.error(f"Account state stream error: {e}", exc_info=True)
+            self.stop_event.wait(max(0.0, self.poll_interval - (time.monotonic() - started)))
@@ -0,0 +1,223 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/supervisor.py
+# Description: اجرای چند ترمینال/حساب متاتریدر روی یک VPS، هر کدام در یک پردازه جدا، با وضعیت تجمیعی.
+# ==================================================================
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import config
+from logger import setup_logger
+from metrics import METRICS, MetricsServer
+
+# کلیدهایی از تنظیمات هر ترمینال که به mt5.initialize داده می‌شوند؛ بقیه تنظیمات ایجنت را بازنویسی می‌کنند
+TERMINAL_KEYS = ("path", "login", "password", "server", "portable", "timeout")
+STATUS_LOG_INTERVAL = 60
+RESTART_BACKOFF = (5, 300)  # کمینه و بیشینه فاصله راه‌اندازی دوباره بر حسب ثانیه
+# فایل‌ها و پوشه‌های محلی که هر پردازه باید نسخه جداگانه خودش را داشته باشد
+PER_TERMINAL_PATHS = ("LOG_FILE", "WATERMARK_FILE", "SPOOL_DIR", "SYMBOL_HASH_FILE", "HTTP_CACHE_FILE",
+                      "TICK_CHECKPOINT_FILE", "RATES_CACHE_DIR")
+
+
+def terminal_settings(settings, entry):
+    """Builds the HeadlessAgent settings of one terminal entry on top of the shared settings."""
+    merged = {key: value for key, value in settings.items() if key not in ("terminals", "metrics")}
+    merged.update({key: value for key, value in entry.items() if key not in TERMINAL_KEYS})
+    merged["terminal"] = {key: entry[key] for key in TERMINAL_KEYS if key in entry}
+    merged.setdefault("metrics", None)
+    return merged
+
+
+def _isolate_state(name):
+    """Points the log, spool and state files of this process at per-terminal paths, e.g. agent.acc1.log."""
+    for attribute in PER_TERMINAL_PATHS:
+        root, extension = os.path.splitext(getattr(config, attribute))
+        setattr(config, attribute, f"{root}.{name}{extension}")
+
+
+def run_terminal(name, settings, status_queue, stop_event):
+    """Entry point of a terminal worker process."""
+    _isolate_state(name)
+    # در حالت spawn ویندوز، سیگنال Ctrl+C به همه پردازه‌ها می‌رسد؛ توقف فقط از طریق stop_event انجام می‌شود
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from headless import HeadlessAgent
+    try:
+        agent = HeadlessAgent(settings, status_queue, stop_event)
+        code = agent.run()
+    except Exception as e:
+        status_queue.put({"terminal": name, "state": "failed", "time": time.time(), "error": str(e)})
+        code = 2
+    status_queue.put({"terminal": name, "state": "exited", "time": time.time(), "exit_code": code})
+    raise SystemExit(code)
+
+
+class TerminalWorker:
+    """Supervisor-side record of one terminal process and its last reported status."""
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.process = None
+        self.state = "stopped"
+        self.login = settings["terminal"].get("login")
+        self.restarts = 0
+        self.syncs_ok = 0
+        self.syncs_failed = 0
+        self.last_error = None
+        self.last_update = None
+        self.next_start = 0.0
+        self.exit_code = None
+        self.finished = False
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def as_dict(self):
+        return {
+            "state": self.state, "login": self.login, "pid": self.process.pid if self.process else None,
+            "alive": self.alive, "exit_code": self.exit_code, "restarts": self.restarts, "syncs_ok": self.syncs_ok,
+            "syncs_failed": self.syncs_failed, "last_error": self.last_error, "last_update": self.last_update,
+        }
+
+
+class TerminalSupervisor:
+    """
+    Runs one HeadlessAgent process per entry of settings["terminals"]. The MetaTrader5 package
+    talks to a single terminal per process, so each account gets its own process with its own
+    MT5Manager, AgentClient and Kafka producer, and throughput scales with cores. Workers report
+    state changes on a shared queue; crashed workers are restarted with exponential backoff.
+    The aggregated status is logged periodically and, with settings["metrics"], exported as
+    agent_terminal_* gauges on the supervisor's metrics endpoint.
+    """
+
+    def __init__(self, settings):
+        self.logger = setup_logger()
+        self.settings = settings
+        self.context = multiprocessing.get_context("spawn")
+        self.status_queue = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.metrics_server = None
+        self.workers = {}
+        for index, entry in enumerate(settings.get("terminals") or []):
+            name = str(entry.get("name") or entry.get("login") or index)
+            worker_settings = terminal_settings(settings, entry)
+            worker_settings["name"] = name
+            self.workers[name] = TerminalWorker(name, worker_settings)
+        if not self.workers:
+            raise ValueError('No terminals configured; add a "terminals" list to the settings file.')
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop_event.set())
+
+    def _start(self, worker):
+        worker.process = self.context.Process(
+            target=run_terminal, name=f"terminal-{worker.name}",
+            args=(worker.name, worker.settings, self.status_queue, self.stop_event), daemon=False)
+        worker.process.start()
+        worker.state = "starting"
+        worker.last_update = time.time()
+        self.logger.info(f"Started terminal worker '{worker.name}' (pid {worker.process.pid}).")
+
+    def _apply(self, message):
+        worker = self.workers.get(message.get("terminal"))
+        if worker is None:
+            return
+        worker.state = message["state"]
+        worker.last_update = message.get("time")
+        if message.get("login"):
+            worker.login = message["login"]
+        if message.get("error"):
+            worker.last_error = message["error"]
+        if message["state"] == "sync_finished":
+            worker.state = "syncing"
+            if message.get("failed"):
+                worker.syncs_failed += 1
+            else:
+                worker.syncs_ok += 1
+        elif message["state"] == "exited":
+            # کد ۲ یعنی ایجنت هرگز آماده نشد (مثلاً ترمینال بالا نیامد) و ارزش تلاش دوباره دارد
+            worker.exit_code = message.get("exit_code")
+            worker.finished = worker.exit_code in (0, 1)
+
+    def _drain_status(self, timeout=1.0):
+        try:
+            message = self.status_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            self._apply(message)
+            try:
+                message = self.status_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.process is None or worker.alive or worker.finished:
+                continue
+            if worker.next_start == 0.0:
+                # پردازه متوقف شده؛ راه‌اندازی دوباره با تاخیر نمایی
+                delay = min(RESTART_BACKOFF[0] * 2 ** worker.restarts, RESTART_BACKOFF[1])
+                worker.next_start = now + delay
+                worker.state = "restarting"
+                self.logger.warning(f"Terminal worker '{worker.name}' exited with code {worker.process.exitcode}; "
+                                    f"restarting in {delay}s.")
+            elif now >= worker.next_start:
+                worker.next_start = 0.0
+                worker.restarts += 1
+                self._start(worker)
+
+    def status(self):
+        """Aggregated status of all terminals, keyed by terminal name."""
+        return {name: worker.as_dict() for name, worker in self.workers.items()}
+
+    def _log_status(self):
+        for name, entry in self.status().items():
+            self.logger.info(f"[{name}] {entry['state']} login={entry['login']} pid={entry['pid']} "
+                             f"syncs ok={entry['syncs_ok']} failed={entry['syncs_failed']} "
+                             f"restarts={entry['restarts']}")
+
+    def _register_metrics(self, options):
+        METRICS.enabled = True
+        for name, worker in self.workers.items():
+            METRICS.gauge_function("agent_terminal_up", lambda w=worker: int(w.alive), terminal=name)
+            METRICS.gauge_function("agent_terminal_restarts", lambda w=worker: w.restarts, terminal=name)
+            METRICS.gauge_function("agent_terminal_syncs_ok", lambda w=worker: w.syncs_ok, terminal=name)
+            METRICS.gauge_function("agent_terminal_syncs_failed", lambda w=worker: w.syncs_failed, terminal=name)
+        if options.get("port") is not None:
+            self.metrics_server = MetricsServer(METRICS, options.get("host", "127.0.0.1"), options["port"])
+            self.metrics_server.start()
+
+    def run(self):
+        """Starts every terminal and supervises them until stopped; returns 0 if every worker exited with 0."""
+        if self.settings.get("metrics"):
+            self._register_metrics(self.settings["metrics"])
+        for worker in self.workers.values():
+            self._start(worker)
+        last_status = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self._drain_status()
+                self._check_workers()
+                if all(worker.finished for worker in self.workers.values()):
+                    break
+                if time.monotonic() - last_status >= STATUS_LOG_INTERVAL:
+                    last_status = time.monotonic()
+                    self._log_status()
+        finally:
+            self.stop_event.set()
+            for worker in self.workers.values():
+                if worker.process is not None:
+                    worker.process.join(self.settings.get("connect_timeout", 60))
+                    if worker.process.is_alive():
+                        self.logger.warning(f"Terminal worker '{worker.name}' did not stop; terminating.")
+                        worker.process.terminate()
+            self._drain_status(timeout=0)
+            self._log_status()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+        return 0 if all(worker.exit_code == 0 for worker in self.workers.values()) else 1
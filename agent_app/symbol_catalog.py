@@ -0,0 +1,97 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/symbol_catalog.py
+# Description: نگهداری hash محتوای هر نماد برای ارسال فقط تغییرات کاتالوگ نمادها.
+# ==================================================================
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+from config import SYMBOL_HASH_FILE
+
+# فیلدهایی که با هر تیک تغییر می‌کنند و نباید باعث ارسال دوباره نماد شوند
+VOLATILE_FIELDS = frozenset({
+    'time', 'time_msc', 'bid', 'bidhigh', 'bidlow', 'ask', 'askhigh', 'asklow', 'last', 'lasthigh', 'lastlow',
+    'spread', 'volume', 'volumehigh', 'volumelow', 'volume_real', 'volumehigh_real', 'volumelow_real',
+    'session_deals', 'session_buy_orders', 'session_sell_orders', 'session_volume', 'session_turnover',
+    'session_interest', 'session_buy_orders_volume', 'session_sell_orders_volume', 'session_open',
+    'session_close', 'session_aw', 'session_price_settlement', 'session_price_limit_min',
+    'session_price_limit_max', 'price_change', 'price_volatility', 'price_theoretical', 'price_greeks_delta',
+    'price_greeks_theta', 'price_greeks_gamma', 'price_greeks_vega', 'price_greeks_rho', 'price_greeks_omega',
+    'price_sensitivity',
+})
+# فاصله زمانی ارسال کامل کاتالوگ به عنوان شبکه ایمنی (ثانیه)
+FULL_RESYNC_INTERVAL = 24 * 3600
+
+
+def symbol_hash(record):
+    """Content hash of a symbol record, ignoring volatile market-data fields."""
+    stable = {key: value for key, value in record.items() if key not in VOLATILE_FIELDS}
+    encoded = json.dumps(stable, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class CatalogDelta:
+    """Difference between the broker's current catalogue and what was last delivered."""
+
+    def __init__(self, full, upserts, removed, hashes):
+        self.full = full
+        self.upserts = upserts      # رکوردهای جدید یا تغییرکرده (در حالت full همه رکوردها)
+        self.removed = removed      # نام نمادهایی که دیگر در بروکر وجود ندارند
+        self.hashes = hashes        # hash های جدید که پس از تحویل موفق ذخیره می‌شوند
+
+    @property
+    def empty(self):
+        return not self.upserts and not self.removed
+
+
+class SymbolCatalogState:
+    """Per-login symbol hashes of the last delivered catalogue, persisted to SYMBOL_HASH_FILE."""
+
+    def __init__(self, path=SYMBOL_HASH_FILE, full_resync_interval=FULL_RESYNC_INTERVAL):
+        self.logger = logging.getLogger("AgentApp")
+        self.path = path
+        self.full_resync_interval = full_resync_interval
+        self.lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable symbol hash file {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def diff(self, login, records, force_full=False):
+        """Compares `records` (symbol dicts) with the stored hashes for `login`."""
+        with self.lock:
+            entry = self._state.get(str(login), {})
+        previous = entry.get("hashes", {})
+        full = force_full or not previous or time.time() - entry.get("last_full", 0) >= self.full_resync_interval
+
+        hashes = {record['name']: symbol_hash(record) for record in records}
+        if full:
+            upserts = list(records)
+        else:
+            upserts = [record for record in records if previous.get(record['name']) != hashes[record['name']]]
+        removed = sorted(set(previous) - set(hashes))
+        return CatalogDelta(full, upserts, removed, hashes)
+
+    def commit(self, login, delta):
+        """Stores the hashes of a delta once it has been delivered."""
+        with self.lock:
+            entry = self._state.setdefault(str(login), {})
+            entry["hashes"] = delta.hashes
+            if delta.full:
+                entry["last_full"] = time.time()
+            self._save()
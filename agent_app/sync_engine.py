@@ -0,0 +1,153 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/sync_engine.py
+# Description: زمان‌بند همگام‌سازی موازی چند نماد با پیشرفت، لغو و تلاش مجدد برای هر نماد.
+# ==================================================================
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import setup_logger
+
+DEFAULT_SYNC_WORKERS = 4
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_DELAY = 5.0
+
+
+class SyncJob:
+    """State of one symbol's rates sync as tracked by the SyncScheduler."""
+
+    def __init__(self, symbol, timeframe, timeframes=None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        # اگر داده شود، چند تایم‌فریم از یک واکشی M1 ساخته و ارسال می‌شوند
+        self.timeframes = timeframes
+        self.state = "queued"  # queued, running, retrying, done, failed, cancelled
+        self.attempts = 0
+        self.current = 0
+        self.total = 0
+        self.acked = 0
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed", "cancelled")
+
+    def __repr__(self):
+        return f"SyncJob({self.symbol!r}, state={self.state!r}, acked={self.acked}/{self.total})"
+
+
+class SyncScheduler:
+    """
+    Syncs many symbols concurrently. Every MetaTrader5 call is already serialized on the
+    MT5Manager's worker thread; the pool here runs the transform, encode and publish stages
+    of different symbols in parallel. Progress and completion are reported to the GUI queue.
+    """
+
+    def __init__(self, client, workers=DEFAULT_SYNC_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY):
+        self.logger = setup_logger()
+        self.client = client
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SyncWorker")
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, symbols, timeframe=None, timeframes=None, skip_busy=False):
+        """
+        Queues a rates sync for each symbol not already queued or running; returns the jobs.
+        With `timeframes` (e.g. ("M1", "H1", "D1")) every listed timeframe is derived from one M1 fetch.
+        With `skip_busy` a symbol that has any unfinished job, whatever its timeframes, is not
+        queued again and that job is returned instead (used by the bar-close refresh).
+        """
+        timeframe = self.client.mt5.default_timeframe if timeframe is None else timeframe
+        timeframes = tuple(timeframes) if timeframes else None
+        jobs = []
+        with self.lock:
+            busy = {job.symbol: job for job in self.jobs.values() if not job.finished} if skip_busy else {}
+            for symbol in symbols:
+                if symbol in busy:
+                    jobs.append(busy[symbol])
+                    continue
+                key = (symbol, timeframes or timeframe)
+                job = self.jobs.get(key)
+                if job is None or job.finished:
+                    job = self.jobs[key] = SyncJob(symbol, timeframe, timeframes)
+                    self.executor.submit(self._run_job, job)
+                jobs.append(job)
+        return jobs
+
+    def cancel(self, symbol=None):
+        """Cancels one symbol's jobs, or every unfinished job when symbol is None."""
+        with self.lock:
+            for job in self.jobs.values():
+                if symbol is None or job.symbol == symbol:
+                    job.cancel_event.set()
+
+    def resume_failed(self):
+        """
+        Resubmits every job that ended in "failed" (e.g. during an MT5 or Kafka outage); only the
+        part after each watermark is fetched again. Returns the number of resubmitted jobs.
+        """
+        with self.lock:
+            failed = [job for job in self.jobs.values() if job.state == "failed"]
+        for job in failed:
+            self.submit([job.symbol], job.timeframe, job.timeframes)
+        return len(failed)
+
+    def status(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def active_count(self):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _post(self, message):
+        self.client.gui_callback_queue.put(message)
+
+    def _run_job(self, job):
+        def progress_callback(current, total):
+            job.current, job.total = current, total
+            self._post({"type": "progress_update", "symbol": job.symbol, "current": current, "total": total})
+
+        def ack_callback(acked):
+            job.acked = acked
+            self._post({"type": "progress_update", "symbol": job.symbol, "acked": acked})
+
+        failed_batches = spooled_batches = 0
+        while not job.cancel_event.is_set():
+            job.attempts += 1
+            job.state = "running"
+            try:
+                if job.timeframes:
+                    report = self.client.sync_rates_multi(job.symbol, progress_callback, job.timeframes, ack_callback,
+                                                          cancel_event=job.cancel_event)
+                else:
+                    report = self.client.sync_rates(job.symbol, progress_callback, job.timeframe, ack_callback,
+                                                    cancel_event=job.cancel_event)
+                failed_batches = len(report.errors)
+                spooled_batches = report.spooled
+                job.error = report.errors[0][1] if report.errors else None
+            except Exception as e:
+                failed_batches = 1
+                job.error = e
+                self.logger.error(f"Sync of {job.symbol} raised: {e}", exc_info=True)
+
+            if job.error is None or job.attempts > self.max_retries:
+                break
+            job.state = "retrying"
+            self.logger.warning(f"Sync of {job.symbol} failed (attempt {job.attempts}), retrying: {job.error}")
+            # فقط ادامه داده‌ها دوباره ارسال می‌شود چون watermark روی بخش تحویل‌شده جلو رفته است
+            job.cancel_event.wait(self.retry_delay * job.attempts)
+
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+        else:
+            job.state = "failed" if job.error is not None else "done"
+        self._post({"type": "sync_finished", "symbol": job.symbol, "failed": failed_batches,
+                    "spooled": spooled_batches, "state": job.state})
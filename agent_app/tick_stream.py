@@ -0,0 +1,156 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/tick_stream.py
+# Description: پخش زنده تیک‌ها به کافکا با ادغام (coalescing) برای هر نماد و حافظه محدود.
+# ==================================================================
+import threading
+import time
+from collections import deque
+import numpy as np
+from logger import setup_logger
+from partitioning import message_key, message_headers
+
+TICKS_TOPIC = "ticks"
+DEFAULT_FLUSH_INTERVAL_MS = 250
+DEFAULT_POLL_INTERVAL_MS = 50
+DEFAULT_MAX_BUFFERED_TICKS = 200000
+DEFAULT_MAX_PENDING_FLUSHES = 4
+
+
+class TickStreamer:
+    """
+    Follows a set of symbols through MT5's tick APIs and publishes them to the ticks topic.
+
+    mode="latest": only the newest tick per symbol is kept and sent every flush interval.
+    mode="all":    every tick is kept and sent per symbol in micro-batches each flush interval.
+
+    At most `max_pending_flushes` flushes (each with all of its per-symbol sends) are in flight;
+    while the broker lags, ticks keep accumulating in a buffer capped at `max_buffered_ticks`
+    (oldest dropped first), so memory stays bounded. Live ticks are never spooled: ticks of a
+    failed send are dropped and counted. Nothing here runs on the Tk thread.
+    """
+
+    def __init__(self, client, symbols, mode="latest", flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS,
+                 poll_interval_ms=DEFAULT_POLL_INTERVAL_MS, max_buffered_ticks=DEFAULT_MAX_BUFFERED_TICKS,
+                 max_pending_flushes=DEFAULT_MAX_PENDING_FLUSHES, topic=TICKS_TOPIC):
+        if mode not in ("latest", "all"):
+            raise ValueError(f"Unknown tick stream mode '{mode}', expected 'latest' or 'all'")
+        self.logger = setup_logger()
+        self.client = client
+        self.mt5 = client.mt5
+        self.symbols = list(symbols)
+        self.mode = mode
+        self.flush_interval = flush_interval_ms / 1000
+        self.poll_interval = poll_interval_ms / 1000
+        self.max_buffered_ticks = max_buffered_ticks
+        self.max_pending_flushes = max_pending_flushes
+        self.topic = topic
+        self.stop_event = threading.Event()
+        self.thread = None
+        self._latest = {}
+        self._buffer = deque()  # (symbol, structured array) تکه‌ها به ترتیب رسیدن
+        self._buffered = 0
+        self._cursors = {}
+        self._pending = deque()  # (futures of one flush, tick count of each future)
+        self.published_ticks = 0
+        self.dropped_ticks = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="TickStreamer", daemon=True)
+        self.thread.start()
+        self.client.log_and_gui(f"Tick stream started for {len(self.symbols)} symbols ({self.mode}).")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.client.log_and_gui(f"Tick stream stopped: {self.published_ticks} ticks published, "
+                                f"{self.dropped_ticks} dropped.")
+
+    def _seed_cursors(self, symbols):
+        # جریان از آخرین تیک هر نماد (به وقت سرور) شروع می‌شود و تاریخچه تیک‌ها را دوباره ارسال نمی‌کند؛
+        # نمادی که هنوز تیکی ندارد در poll های بعدی دوباره امتحان می‌شود
+        for symbol, tick in self.mt5.get_last_ticks(symbols).items():
+            self._cursors[symbol] = tick['time_msc']
+
+    def _poll(self):
+        if self.mode == "latest":
+            for symbol, tick in self.mt5.get_last_ticks(self.symbols).items():
+                previous = self._latest.get(symbol)
+                if previous is None or tick['time_msc'] > previous['time_msc']:
+                    tick['symbol'] = symbol
+                    self._latest[symbol] = tick
+            return
+
+        if len(self._cursors) < len(self.symbols):
+            self._seed_cursors([symbol for symbol in self.symbols if symbol not in self._cursors])
+        for symbol, ticks in self.mt5.get_ticks_since(self._cursors).items():
+            self._cursors[symbol] = int(ticks['time_msc'][-1])
+            self._buffer.append((symbol, ticks))
+            self._buffered += len(ticks)
+        while self._buffered > self.max_buffered_ticks and len(self._buffer) > 1:
+            _, dropped = self._buffer.popleft()
+            self._buffered -= len(dropped)
+            self.dropped_ticks += len(dropped)
+
+    def _collect(self):
+        """Drops finished flushes; ticks of sends that failed (or never started) are counted as dropped."""
+        while self._pending and all(future is None or future.done() for future, _ in self._pending[0]):
+            for future, count in self._pending.popleft():
+                if future is None or future.cancelled() or future.exception() is not None or not future.result():
+                    self.published_ticks -= count
+                    self.dropped_ticks += count
+
+    def _flush(self):
+        self._collect()
+        if len(self._pending) >= self.max_pending_flushes:
+            return  # کافکا عقب است؛ داده در بافر محدود می‌ماند
+
+        meta = {"type": "ticks", "login": self.client.login_number}
+        if self.mode == "latest":
+            if not self._latest:
+                return
+            ticks = list(self._latest.values())
+            self._latest = {}
+            futures = [(self.client.send_message(self.topic, {**meta, "mode": "latest", "ticks": ticks},
+                                                 message_key(self.client.login_number),
+                                                 message_headers("ticks", "json", rows=len(ticks), mode="latest"),
+                                                 spool=False), len(ticks))]
+            count = len(ticks)
+        else:
+            if not self._buffer:
+                return
+            per_symbol = {}
+            for symbol, ticks in self._buffer:
+                per_symbol.setdefault(symbol, []).append(ticks)
+            self._buffer.clear()
+            count, self._buffered = self._buffered, 0
+            codec = self.client.rates_codec
+            futures = []
+            for symbol, chunks in per_symbol.items():
+                batch = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+                futures.append((self.client.send_message(
+                    self.topic, codec.encode_rates({**meta, "symbol": symbol}, batch),
+                    message_key(self.client.login_number, symbol),
+                    message_headers("ticks", codec.name, rows=len(batch), mode="all"), spool=False), len(batch)))
+        self._pending.append(futures)
+        self.published_ticks += count
+
+    def _run(self):
+        try:
+            self._seed_cursors(self.symbols)
+        except Exception as e:
+            self.client.log_and_gui(f"Tick stream could not start: {e}", "error")
+            return
+        next_flush = time.monotonic() + self.flush_interval
+        while not self.stop_event.is_set():
+            try:
+                self._poll()
+                if time.monotonic() >= next_flush:
+                    self._flush()
+                    next_flush = time.monotonic() + self.flush_interval
+            except Exception as e:
+                self.logger.error(f"Tick stream error: {e}", exc_info=True)
+            self.stop_event.wait(self.poll_interval)
@@ -0,0 +1,87 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/watermarks.py
+# Description: نگهداری high-water mark آخرین کندل ارسال‌شده برای هر (login, symbol, timeframe).
+# ==================================================================
+import json
+import os
+import threading
+import logging
+from config import WATERMARK_FILE
+
+
+class WatermarkStore:
+    """
+    Persists the epoch time of the newest bar already delivered downstream,
+    keyed by (login, symbol, timeframe), so re-syncs only fetch the tail.
+    """
+
+    def __init__(self, path=WATERMARK_FILE):
+        self.logger = logging.getLogger("AgentApp")
+        self.path = path
+        self.lock = threading.Lock()
+        self._marks = self._load()
+
+    @staticmethod
+    def _key(login, symbol, timeframe):
+        return f"{login}|{symbol}|{int(timeframe)}"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {k: int(v) for k, v in data.items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable watermark file {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._marks, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, login, symbol, timeframe):
+        """Returns the stored mark (epoch seconds) or None if the series was never synced."""
+        with self.lock:
+            return self._marks.get(self._key(login, symbol, timeframe))
+
+    def advance(self, login, symbol, timeframe, bar_time):
+        """Moves the mark forward; a mark never goes backwards."""
+        key = self._key(login, symbol, timeframe)
+        with self.lock:
+            if bar_time <= self._marks.get(key, -1):
+                return
+            self._marks[key] = int(bar_time)
+            self._save()
+
+    def reset(self, login, symbol=None, timeframe=None):
+        """Drops marks for a login (optionally narrowed to a symbol/timeframe) to force a full re-sync."""
+        with self.lock:
+            for key in list(self._marks):
+                k_login, k_symbol, k_timeframe = key.split('|')
+                if k_login != str(login):
+                    continue
+                if symbol is not None and k_symbol != symbol:
+                    continue
+                if timeframe is not None and k_timeframe != str(int(timeframe)):
+                    continue
+                del self._marks[key]
+            self._save()
+
+    def seed(self, login, entries):
+        """
+        Seeds marks from the DB handler. `entries` is a list of
+        {"symbol": ..., "timeframe": ..., "last_time": ...} dicts; the DB is
+        authoritative, so a seeded mark replaces the local one.
+        """
+        with self.lock:
+            for entry in entries:
+                try:
+                    key = self._key(login, entry['symbol'], entry['timeframe'])
+                    self._marks[key] = int(entry['last_time'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self._save()
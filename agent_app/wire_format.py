@@ -0,0 +1,88 @@
+# ==================================================================
+# File: Mani_FAI_Client/agent_app/wire_format.py
+# Description: کدک‌های قابل تعویض برای سریال‌سازی batch های کندل قبل از ارسال به کافکا.
+# ==================================================================
+import json
+import struct
+import numpy as np
+
+
+class JsonCodec:
+    """
+    Compatibility codec: one JSON object per batch with a list of row dicts,
+    exactly what the DB handler consumed before the columnar format existed.
+    """
+    name = "json"
+    content_type = "application/json"
+    # MT5Manager خروجی را به صورت لیست دیکشنری (مسیر pandas قدیمی) تحویل می‌دهد
+    wants_raw = False
+
+    @staticmethod
+    def rates_to_records(rates):
+        """Converts a MT5 structured array to the legacy list-of-dicts layout."""
+        time_real = np.char.replace(rates['time'].astype('datetime64[s]').astype(str), 'T', ' ')
+        columns = {name: rates[name].tolist() for name in rates.dtype.names}
+        columns['time_real'] = time_real.tolist()
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+    def encode_rates(self, meta, batch):
+        if isinstance(batch, np.ndarray):
+            batch = self.rates_to_records(batch)
+        return json.dumps({**meta, "data": batch}).encode('utf-8')
+
+
+class ColumnarCodec:
+    """
+    Packs a MT5 structured array column by column without building per-row objects.
+
+    Layout (all little-endian):
+        b"MFC1" | uint32 header length | JSON header | column 1 bytes | column 2 bytes | ...
+    The header carries the batch metadata plus "rows" and "columns" ([name, numpy dtype] pairs);
+    each column is a contiguous fixed-width array in header order. `time` stays epoch seconds.
+    """
+    name = "columnar"
+    content_type = "application/x-mfc-columnar"
+    wants_raw = True
+    MAGIC = b"MFC1"
+    _LENGTH = struct.Struct("<I")
+
+    def encode_rates(self, meta, batch):
+        if not isinstance(batch, np.ndarray):
+            raise TypeError("ColumnarCodec expects the structured array returned by MetaTrader5")
+        columns = []
+        chunks = []
+        for name in batch.dtype.names:
+            column = np.ascontiguousarray(batch[name], dtype=batch.dtype[name].newbyteorder('<'))
+            columns.append([name, column.dtype.str])
+            chunks.append(column.tobytes())
+        header = json.dumps({**meta, "rows": len(batch), "columns": columns}).encode('utf-8')
+        return b"".join([self.MAGIC, self._LENGTH.pack(len(header)), header, *chunks])
+
+    @classmethod
+    def decode(cls, payload):
+        """Returns (header, {column name: numpy array}); the arrays are views on `payload`."""
+        if payload[:4] != cls.MAGIC:
+            raise ValueError("Not a columnar batch")
+        (header_length,) = cls._LENGTH.unpack_from(payload, 4)
+        offset = 4 + cls._LENGTH.size
+        header = json.loads(payload[offset:offset + header_length])
+        offset += header_length
+        rows = header["rows"]
+        columns = {}
+        for name, dtype in header["columns"]:
+            dtype = np.dtype(dtype)
+            columns[name] = np.frombuffer(payload, dtype=dtype, count=rows, offset=offset)
+            offset += rows * dtype.itemsize
+        return header, columns
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), ColumnarCodec())}
+
+
+def get_codec(name):
+    """Looks up a registered codec by name."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown wire format '{name}', expected one of {sorted(CODECS)}") from None